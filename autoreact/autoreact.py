@@ -1,17 +1,700 @@
+import asyncio
+import bisect
 import json
+import math
 import os
+import re
+import time
+import traceback
+from collections import Counter, deque
+from collections.abc import Sequence
+from concurrent.futures import TimeoutError
 from re import compile
-from typing import Union
+from typing import Optional, Union
 from uuid import uuid4
 
 import Paginator
 import discord
 from discord.ext import commands
+from pebble import ProcessExpired, ProcessPool
 
 from core import checks
 from core.models import PermissionLevel
 
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
 CONFIG_FILE = os.path.dirname(__file__) + "/autoreact.json"
+JOURNAL_FILE = os.path.dirname(__file__) + "/autoreact.journal"
+CONFIG_FLUSH_DELAY = 2  # Time in seconds changes are batched for, before being appended to the journal
+CONFIG_COMPACT_ENTRIES = 200  # Number of journal entries after which the journal is compacted into the config file
+STATS_FILE = os.path.dirname(__file__) + "/stats.json"
+STATS_FLUSH_INTERVAL = 60  # Time in seconds between writes of autoreact stats to disk
+TIMING_BUCKETS = 100  # Buckets of the matcher time histogram, 4 per doubling starting at 1µs (up to ~33s)
+LIST_PAGE_SIZE = 15  # Autoreacts per page of send_list
+REACTION_CONCURRENCY = 4  # Max reaction requests in flight at once, across all messages
+REGEX_WORKERS = 2  # Number of worker processes regex triggers are matched in
+REGEX_TIME_BUDGET = 0.25  # Time in seconds all regex triggers may take to match a message, before being killed
+REGEX_SCANNER_SIZE = 32  # Max regex triggers combined into a single scanner
+REGEX_CHECK_LENGTH = 4000  # Length of the adversarial messages new regex triggers are tested against (max message size)
+GLOBAL_SCOPE = "global"  # Scope of the triggers without one, matched in every channel
+# Patterns that can't be safely combined with others: backreferences (numbering changes), named groups (names could
+#  clash), conditionals, and global inline flags (only allowed at the start)
+UNCOMBINABLE_REGEX = compile(r"\\[1-9]|\(\?P[<=]|\(\?<[^=!]|\(\?\(|\(\?[aiLmsux]+\)")
+
+
+def build_scanners(patterns: dict) -> list:
+    """Combine regex triggers into as few scanners as possible. Each scanner is a single alternation of up to
+    REGEX_SCANNER_SIZE patterns, so a message that matches none of them (most messages) is scanned once per scanner.
+
+    :param patterns: Trigger ID -> regex pattern
+    :return: List of (combined pattern, [(trigger ID, pattern), ...])
+    """
+    scanners = []
+    chunk = []
+    for uuid, pattern in patterns.items():
+        if UNCOMBINABLE_REGEX.search(pattern):
+            scanners.append((pattern, [(uuid, pattern)]))
+            continue
+        chunk.append((uuid, pattern))
+        if len(chunk) == REGEX_SCANNER_SIZE:
+            scanners.append(("|".join(f"(?:{i})" for _, i in chunk), chunk))
+            chunk = []
+    if chunk:
+        scanners.append(("|".join(f"(?:{i})" for _, i in chunk), chunk))
+    return scanners
+
+
+_scanners = {}  # Scope -> compiled scanners, in worker processes
+
+
+def _load_scanners(scanners: dict):
+    """Pool initializer, compiles the scanners (see build_scanners) of every scope in every new worker process."""
+    global _scanners
+    _scanners = {
+        scope: [
+            (compile(combined), [(uuid, compile(pattern)) for uuid, pattern in patterns])
+            for combined, patterns in scope_scanners
+        ]
+        for scope, scope_scanners in scanners.items()
+    }
+
+
+def _scan(content: str, scopes: list) -> list:
+    """Match a message against the scanners of its scopes, in a worker process.
+
+    :param content: Message content
+    :param scopes: Scopes the message is in (see message_scopes)
+    :return: IDs of the regex triggers that match
+    """
+    matches = []
+    for scope in scopes:
+        for combined, patterns in _scanners.get(scope, ()):
+            if not combined.search(content):
+                continue
+            if len(patterns) == 1:
+                matches.append(patterns[0][0])
+            else:  # Find which of the combined patterns matched
+                matches.extend(uuid for uuid, pattern in patterns if pattern.search(content))
+    return matches
+
+
+def _search(pattern: str, content: str) -> bool:
+    """Match a message against a single pattern, in a worker process."""
+    return compile(pattern).search(content) is not None
+
+
+def _search_time(pattern: str, content: str) -> float:
+    """Time matching a message against a single pattern (excluding compiling it), in a worker process."""
+    pattern = compile(pattern)
+    start = time.perf_counter()
+    pattern.search(content)
+    return time.perf_counter() - start
+
+
+def find_nested_quantifier(pattern: str) -> bool:
+    """Statically check a pattern for nested quantifiers (e.g. (a+)+), the usual cause of catastrophic backtracking.
+
+    :param pattern: Regex pattern
+    :return: Whether the pattern has an unbounded quantifier inside another quantifier
+    """
+
+    def walk(items, in_repeat: bool) -> bool:
+        for op, av in items:
+            if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                low, high, sub = av
+                if in_repeat and high == sre_parse.MAXREPEAT:
+                    return True
+                if walk(sub, in_repeat or high > 1):
+                    return True
+            elif op is sre_parse.SUBPATTERN:
+                if walk(av[-1], in_repeat):
+                    return True
+            elif op is sre_parse.BRANCH:
+                if any(walk(branch, in_repeat) for branch in av[1]):
+                    return True
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                if walk(av[1], in_repeat):
+                    return True
+            elif op is sre_parse.GROUPREF_EXISTS:
+                if any(branch is not None and walk(branch, in_repeat) for branch in av[1:]):
+                    return True
+            # Possessive quantifiers and atomic groups never backtrack, so they're skipped
+        return False
+
+    return walk(sre_parse.parse(pattern), False)
+
+
+def adversarial_inputs(pattern: str) -> list:
+    """Build messages likely to make a pattern backtrack catastrophically: long runs of the characters it matches on,
+    ending in a character that (usually) makes the match fail at the very end.
+
+    :param pattern: Regex pattern
+    :return: List of messages, REGEX_CHECK_LENGTH long
+    """
+    chars = ["a", "0", " "]
+
+    def literals(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                chars.append(chr(av))
+            elif isinstance(av, sre_parse.SubPattern):
+                literals(av)
+            elif isinstance(av, (list, tuple)):
+                for i in av:
+                    if isinstance(i, sre_parse.SubPattern):
+                        literals(i)
+                    elif isinstance(i, list):  # Branches
+                        for j in i:
+                            if isinstance(j, sre_parse.SubPattern):
+                                literals(j)
+
+    literals(sre_parse.parse(pattern))
+    chars = list(dict.fromkeys(chars))[:16]
+    inputs = [char * (REGEX_CHECK_LENGTH - 1) + "\x00" for char in chars]
+    inputs.append(("".join(chars) * REGEX_CHECK_LENGTH)[:REGEX_CHECK_LENGTH - 1] + "\x00")
+    return inputs
+
+
+class RegexScanner:
+    """Matches messages against the regex triggers of their scopes in worker processes, under a time budget, so a badly
+    written regex can never freeze the bot. The pool is rebuilt whenever the regex triggers change."""
+
+    def __init__(self):
+        self.patterns = {}  # Scope -> {trigger ID: regex pattern}
+        self.pool = None
+
+    def rebuild(self, patterns: dict):
+        """Rebuild the scanners and the pool for a new set of regex triggers.
+
+        :param patterns: Scope -> {trigger ID: regex pattern}
+        """
+        old = self.pool
+        self.patterns = patterns
+        self.pool = ProcessPool(
+            max_workers=REGEX_WORKERS, initializer=_load_scanners,
+            initargs=({scope: build_scanners(i) for scope, i in patterns.items()},)
+        )
+        if old is not None:
+            old.close()  # Lets scans that are already running finish
+
+    def stop(self):
+        """Stop the pool, killing any running scans."""
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    async def scan(self, content: str, scopes: list) -> set:
+        """Match a message against the regex triggers of its scopes.
+
+        :param content: Message content
+        :param scopes: Scopes the message is in (see message_scopes)
+        :return: IDs of the regex triggers that match
+        :raises concurrent.futures.TimeoutError: Matching took longer than REGEX_TIME_BUDGET
+        """
+        scopes = [scope for scope in scopes if scope in self.patterns]
+        if not scopes:
+            return set()
+        return set(
+            await asyncio.wrap_future(self.pool.schedule(_scan, args=(content, scopes), timeout=REGEX_TIME_BUDGET))
+        )
+
+    async def is_slow(self, pattern: str, contents: list) -> bool:
+        """Check whether a pattern takes longer than REGEX_TIME_BUDGET to match any of the given messages."""
+        results = await asyncio.gather(
+            *(
+                asyncio.wrap_future(self.pool.schedule(_search, args=(pattern, content), timeout=REGEX_TIME_BUDGET))
+                for content in contents
+            ),
+            return_exceptions=True
+        )
+        return any(isinstance(result, (TimeoutError, ProcessExpired)) for result in results)
+
+    async def find_slow(self, content: str, scopes: list) -> list:
+        """Find which regex triggers of a message's scopes to disable so matching it fits in REGEX_TIME_BUDGET: the ones
+        that take longer than the budget on their own, then the slowest of the others until the rest fit in it together.
+
+        :param content: Message content
+        :param scopes: Scopes the message is in (see message_scopes)
+        :return: IDs of the slow regex triggers, slowest first
+        """
+        patterns = [i for scope in scopes for i in self.patterns.get(scope, {}).items()]
+        results = await asyncio.gather(
+            *(
+                asyncio.wrap_future(self.pool.schedule(_search_time, args=(pattern, content), timeout=REGEX_TIME_BUDGET))
+                for _, pattern in patterns
+            ),
+            return_exceptions=True
+        )
+        slow = [uuid for (uuid, _), result in zip(patterns, results) if isinstance(result, Exception)]
+        times = sorted(
+            ((result, uuid) for (uuid, _), result in zip(patterns, results) if not isinstance(result, Exception)),
+            reverse=True
+        )
+        total = sum(elapsed for elapsed, _ in times)
+        for elapsed, uuid in times:
+            if total <= REGEX_TIME_BUDGET:
+                break
+            slow.append(uuid)
+            total -= elapsed
+        return slow
+
+    async def check(self, pattern: str):
+        """Check a new pattern for catastrophic backtracking, statically and empirically.
+
+        :param pattern: Regex pattern
+        :return: Reason the pattern was rejected, None if it's fine
+        """
+        if find_nested_quantifier(pattern):
+            return "It has a quantifier nested inside another quantifier (e.g. `(a+)+`), which can backtrack " \
+                   "catastrophically."
+        if await self.is_slow(pattern, adversarial_inputs(pattern)):
+            return f"It took longer than {REGEX_TIME_BUDGET}s to match a test message."
+        return None
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton, finding every phrase that occurs in a text in a single pass over it."""
+
+    def __init__(self, phrases: dict):
+        """
+        :param phrases: Trigger ID -> phrase to match (already lowercased)
+        """
+        self.goto = [{}]  # State -> {character: next state}, state 0 is the root
+        self.fail = [0]  # State -> state of the longest proper suffix that is also in the trie
+        self.output = [[]]  # State -> IDs of the triggers whose phrase ends here (including via fail links)
+        for trigger_id, phrase in phrases.items():
+            state = 0
+            for char in phrase:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(trigger_id)
+
+        # Breadth-first, so fail links always point to states that are already done
+        queue = deque(self.goto[0].values())
+        for state in queue:
+            self.output[state] = self.output[state] + self.output[0]
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text: str) -> set:
+        """Find every phrase in a text.
+
+        :param text: Text to search (already lowercased)
+        :return: IDs of the triggers whose phrase occurs in the text
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set(output[0])  # Empty phrases match anything
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+def write_json_atomic(path: str, data):
+    """Write JSON data to a file atomically (write to a temporary file, then replace), so a crash mid-write can never
+    leave a corrupted file behind. Blocking, run via asyncio.to_thread.
+
+    :param path: Path of the file to write
+    :param data: Data to write, must be JSON-serializable
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ConfigJournal:
+    """Owns the autoreact config, persisted as a snapshot (the config file) plus an append-only journal of the changes
+    made since. Changes are appended in batches, and the journal is compacted into a new snapshot once it grows, both
+    off the event loop. The snapshot is replaced atomically and torn journal lines are skipped, so a crash loses at
+    most the last batch of changes."""
+
+    def __init__(self, path: str, journal_path: str):
+        self.path = path
+        self.journal_path = journal_path
+        self.config = {}
+        self.pending = []  # Changes not yet appended to the journal
+        self.entries = 0  # Changes in the journal on disk
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+    def load(self) -> dict:
+        """Load the snapshot and replay the journal over it. Blocking.
+
+        :return: The config, Trigger ID -> trigger data
+        """
+        if not os.path.exists(self.path):
+            write_json_atomic(self.path, {})
+        with open(self.path, encoding="utf-8") as f:
+            config = json.load(f)
+        self.entries = 0
+        torn = False
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:  # Torn write, from a crash mid-append
+                        torn = True
+                        continue
+                    if change["op"] == "set":
+                        config[change["id"]] = change["data"]
+                    else:
+                        config.pop(change["id"], None)
+                    self.entries += 1
+        except FileNotFoundError:
+            pass
+        if torn:  # Start a fresh journal, so the next append doesn't end up on the torn line
+            self.compact(config)
+            self.entries = 0
+        self.config = config
+        self.pending = []
+        return config
+
+    def set(self, uuid: str, data: dict):
+        """Add or replace a trigger."""
+        self.config[uuid] = data
+        self.record({"op": "set", "id": uuid, "data": dict(data)})
+
+    def delete(self, uuid: str):
+        """Remove a trigger."""
+        del self.config[uuid]
+        self.record({"op": "delete", "id": uuid})
+
+    def record(self, change: dict):
+        """Queue a change for the journal, flushing it after CONFIG_FLUSH_DELAY."""
+        self.pending.append(change)
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(CONFIG_FLUSH_DELAY)
+        self.timer = None
+        await self.flush()
+
+    def append(self, lines: str):
+        """Append lines to the journal. Blocking, run via asyncio.to_thread."""
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self, snapshot: dict):
+        """Replace the snapshot, then empty the journal. Blocking, run via asyncio.to_thread. Replaying a journal that
+        is already in the snapshot (crash in between) gives the same config, so the two steps needn't be atomic."""
+        write_json_atomic(self.path, snapshot)
+        open(self.journal_path, "w", encoding="utf-8").close()
+
+    async def flush(self, compact: bool = False):
+        """Append pending changes to the journal, and compact it if it grew too large, off the event loop.
+
+        :param compact: Compact the journal no matter its size, leaving a single consolidated config file
+        """
+        async with self.lock:
+            if self.pending:
+                lines = "".join(json.dumps(change) + "\n" for change in self.pending)
+                self.entries += len(self.pending)
+                self.pending = []
+                await asyncio.to_thread(self.append, lines)
+            if self.entries and (compact or self.entries >= CONFIG_COMPACT_ENTRIES):
+                # Copied on the loop, so it can't change mid-write. Changes made after this are still pending
+                snapshot = {uuid: dict(data) for uuid, data in self.config.items()}
+                await asyncio.to_thread(self.compact, snapshot)
+                self.entries = 0
+
+
+class TriggerStats:
+    """Autoreact telemetry: hits per trigger, failed reactions by reason, and a histogram of the time spent matching
+    each message. Aggregated in memory, and persisted to disk in batches, off the event loop."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = Counter()  # Trigger ID -> messages it matched
+        self.failures = Counter()  # Reason -> failed reaction requests
+        self.histogram = [0] * TIMING_BUCKETS  # Bucket -> messages whose matching took that long (see record_match)
+        self.since = time.time()
+        self.dirty = False
+
+    def load(self):
+        """Load the stats from disk, adding them to anything recorded since startup. Blocking, run via
+        asyncio.to_thread."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.hits.update(data.get("hits", {}))
+        self.failures.update(data.get("failures", {}))
+        histogram = data.get("histogram", [])
+        if len(histogram) == TIMING_BUCKETS:
+            self.histogram = [a + b for a, b in zip(self.histogram, histogram)]
+        self.since = data.get("since", self.since)
+
+    def record_match(self, elapsed: float, matches: set):
+        """Record a matched message.
+
+        :param elapsed: Time in seconds matching took
+        :param matches: IDs of the triggers that matched
+        """
+        self.histogram[min(max(int(4 * math.log2(elapsed * 1e6 or 1)), 0), TIMING_BUCKETS - 1)] += 1
+        if matches:
+            self.hits.update(matches)
+        self.dirty = True
+
+    def record_failure(self, reason: str):
+        """Record a failed reaction request."""
+        self.failures[reason] += 1
+        self.dirty = True
+
+    def forget(self, uuid: str):
+        """Drop the hits of a removed trigger."""
+        if self.hits.pop(uuid, None) is not None:
+            self.dirty = True
+
+    def percentile(self, q: float):
+        """Estimate a percentile of the matcher time, from the histogram.
+
+        :param q: Percentile, between 0 and 100
+        :return: Upper bound of the bucket it falls in, in seconds, None if no messages were matched yet
+        """
+        total = sum(self.histogram)
+        if not total:
+            return None
+        target = total * q / 100
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target and count:
+                return 2 ** ((bucket + 1) / 4) / 1e6
+        return 2 ** (TIMING_BUCKETS / 4) / 1e6
+
+    async def flush(self):
+        """Write the stats to disk if they changed, off the event loop."""
+        if not self.dirty:
+            return
+        self.dirty = False
+        data = {
+            "since": self.since,
+            "hits": dict(self.hits),
+            "failures": dict(self.failures),
+            "histogram": list(self.histogram),
+        }
+        try:
+            await asyncio.to_thread(write_json_atomic, self.path, data)
+        except BaseException:  # Try again next time
+            self.dirty = True
+            raise
+
+
+def trigrams(text: str) -> set:
+    """Get the trigrams (substrings of length 3) of a text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TriggerIndex:
+    """Trigram inverted index over the trigger text, emoji and ID of every trigger, so a search only checks the triggers
+    that contain every trigram of the query, instead of all of them. Custom emoji names are kept sorted as well, for
+    prefix queries. Updated one trigger at a time, as triggers are added and removed."""
+
+    def __init__(self):
+        self.fields = {}  # Trigger ID -> searchable fields (lowercased)
+        self.grams = {}  # Trigram -> IDs of the triggers with it in any field
+        self.names = []  # (Custom emoji name (lowercased), trigger ID), sorted
+        self.emoji_names = {}  # Trigger ID -> custom emoji name (lowercased)
+
+    def add(self, uuid: str, fields: list, emoji_name: Optional[str] = None):
+        """Add a trigger to the index, replacing it if it's already in it.
+
+        :param uuid: Trigger ID
+        :param fields: Searchable fields (trigger text, emoji, ID)
+        :param emoji_name: Name of the trigger's custom emoji, if it's resolved
+        """
+        self.remove(uuid)
+        fields = [field.lower() for field in fields]
+        self.fields[uuid] = fields
+        for gram in set().union(*map(trigrams, fields)):
+            self.grams.setdefault(gram, set()).add(uuid)
+        if emoji_name is not None:
+            emoji_name = emoji_name.lower()
+            self.emoji_names[uuid] = emoji_name
+            bisect.insort(self.names, (emoji_name, uuid))
+
+    def remove(self, uuid: str):
+        """Remove a trigger from the index, if it's in it."""
+        fields = self.fields.pop(uuid, None)
+        if fields is None:
+            return
+        for gram in set().union(*map(trigrams, fields)):
+            posting = self.grams[gram]
+            posting.discard(uuid)
+            if not posting:
+                del self.grams[gram]
+        emoji_name = self.emoji_names.pop(uuid, None)
+        if emoji_name is not None:
+            del self.names[bisect.bisect_left(self.names, (emoji_name, uuid))]
+
+    def search(self, query: str, order: dict) -> list:
+        """Find the triggers matching a query, best first: an exact field or emoji name, then a prefix of one, then a
+        substring of a field. Queries shorter than a trigram check every trigger.
+
+        :param query: Text to search for, case-insensitive (surrounding colons are ignored for emoji names)
+        :param order: Trigger ID -> position in config, to break ties
+        :return: IDs of the matching triggers
+        """
+        query = query.lower()
+        ranks = {}
+        name = query.strip(":")
+        if name:
+            start = bisect.bisect_left(self.names, (name,))
+            for emoji_name, uuid in self.names[start:]:
+                if not emoji_name.startswith(name):
+                    break
+                ranks[uuid] = 0 if emoji_name == name else 1
+
+        if len(query) < 3:
+            candidates = self.fields
+        else:
+            postings = sorted((self.grams.get(gram, set()) for gram in trigrams(query)), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        for uuid in candidates:
+            rank = None
+            for field in self.fields[uuid]:
+                if field == query:
+                    rank = 0
+                    break
+                if field.startswith(query):
+                    rank = 1
+                elif rank is None and query in field:
+                    rank = 2
+            if rank is not None and rank < ranks.get(uuid, 3):
+                ranks[uuid] = rank
+        return sorted(ranks, key=lambda uuid: (ranks[uuid], order.get(uuid, 0)))
+
+
+class ListPages(Sequence):
+    """Pages for Paginator.Simple, rendered only when first shown, so long lists don't build every embed up front."""
+
+    def __init__(self, items: list, render):
+        """
+        :param items: Items to list
+        :param render: Function building the embed for a page, from its items
+        """
+        self.items = items
+        self.render = render
+        self.pages = {}
+
+    def __len__(self):
+        return -(-len(self.items) // LIST_PAGE_SIZE)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        if index not in self.pages:
+            self.pages[index] = self.render(self.items[index * LIST_PAGE_SIZE:(index + 1) * LIST_PAGE_SIZE])
+        return self.pages[index]
+
+
+def message_scopes(message: discord.Message) -> list:
+    """Get the scopes a message is in, whose triggers it's matched against: global, its guild, its category, its
+    channel, and its thread's parent channel.
+
+    :param message: Message
+    :return: List of scopes ("global", "guild:<id>", "category:<id>" or "channel:<id>")
+    """
+    scopes = [GLOBAL_SCOPE]
+    if message.guild is not None:
+        scopes.append(f"guild:{message.guild.id}")
+    channel = message.channel
+    scopes.append(f"channel:{channel.id}")
+    parent = getattr(channel, "parent", None)  # Threads
+    if parent is not None:
+        scopes.append(f"channel:{parent.id}")
+        channel = parent
+    category_id = getattr(channel, "category_id", None)
+    if category_id is not None:
+        scopes.append(f"category:{category_id}")
+    return scopes
+
+
+def scope_label(scope: str) -> str:
+    """Format a scope for display."""
+    kind, _, scope_id = scope.partition(":")
+    if kind == "channel":
+        return f"in <#{scope_id}>"
+    if kind == "category":
+        return f"in category <#{scope_id}>"
+    if kind == "guild":
+        return f"in guild `{scope_id}`"
+    return "everywhere"
+
+
+class Scope(commands.Converter):
+    """Converts `channel:<channel>`, `category:<category>` or `guild:[guild]` (this guild by default) to a scope."""
+
+    async def convert(self, ctx: commands.Context, argument: str) -> str:
+        kind, sep, value = argument.partition(":")
+        kind = kind.lower()
+        if not sep:
+            raise commands.BadArgument(f"`{argument}` is not a scope.")
+        if kind == "channel":
+            channel = await commands.GuildChannelConverter().convert(ctx, value)
+            if isinstance(channel, discord.CategoryChannel):
+                return f"category:{channel.id}"
+            return f"channel:{channel.id}"
+        if kind == "category":
+            return f"category:{(await commands.CategoryChannelConverter().convert(ctx, value)).id}"
+        if kind == "guild":
+            guild = await commands.GuildConverter().convert(ctx, value) if value else ctx.guild
+            if guild is None:
+                raise commands.BadArgument("No guild to scope to.")
+            return f"guild:{guild.id}"
+        raise commands.BadArgument(f"`{argument}` is not a scope.")
 
 
 class AutoReact(commands.Cog):
@@ -19,15 +702,137 @@ class AutoReact(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.compiled_regexes = {}
         self.config = {}
+        self.journal = ConfigJournal(CONFIG_FILE, JOURNAL_FILE)
+        self.trigger_order = {}  # Trigger ID -> position in config, so reactions keep the config's order
+        self.phrase_matchers = {}  # Scope -> phrase matcher
+        self.regex_scanner = RegexScanner()
+        self.finding_slow = False
+        self.reaction_semaphore = asyncio.Semaphore(REACTION_CONCURRENCY)
+        self.emojis = {}  # Trigger ID -> emoji to react with (resolved), for triggers that aren't dormant
+        self.emoji_triggers = {}  # Custom emoji ID -> IDs of the triggers using it
+        self.dormant = set()  # IDs of the triggers whose custom emoji can't be found (deleted, or guild left)
+        self.search_index = TriggerIndex()
+        self.stats = TriggerStats(STATS_FILE)
+        self.stats_task = None
         self.load_config()
+        self.bot.loop.create_task(self.async_init())
+
+    async def async_init(self):
+        await asyncio.to_thread(self.stats.load)
+        self.stats_task = self.bot.loop.create_task(self.flush_stats())
+        await self.bot.wait_until_ready()
+        self.compile_triggers()  # Emoji cache is only filled once ready
+        for uuids in self.emoji_triggers.values():
+            for uuid in uuids:
+                self.index_trigger(uuid)  # With their emoji names
+
+    async def cog_unload(self):
+        self.regex_scanner.stop()
+        if self.journal.timer is not None:
+            self.journal.timer.cancel()
+        await self.journal.flush(compact=True)
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+        await self.stats.flush()
+
+    async def flush_stats(self):
+        """Periodically write the autoreact stats to disk, batching the changes in between."""
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            try:
+                await self.stats.flush()
+            except (Exception,):  # Keep trying, changes made since will still be written next time
+                traceback.print_exc()
+
+    def compile_triggers(self):
+        """Rebuild the compiled trigger set from the config, run whenever triggers are loaded, added or removed."""
+        self.trigger_order = {uuid: i for i, uuid in enumerate(self.config)}
+        self.emojis = {}
+        self.emoji_triggers = {}
+        self.dormant = set()
+        for uuid, data in self.config.items():
+            if isinstance(data["emoji"], str):
+                self.emojis[uuid] = data["emoji"]
+                continue
+            self.emoji_triggers.setdefault(data["emoji"], []).append(uuid)
+            emoji = self.bot.get_emoji(data["emoji"])
+            if emoji is not None:
+                self.emojis[uuid] = emoji
+            elif self.bot.is_ready():  # Before then, the emoji cache isn't filled yet (resolved again once ready)
+                self.dormant.add(uuid)
+        self.build_matchers()
+
+    def index_trigger(self, uuid: str):
+        """Add a trigger to the search index, or update it there."""
+        data = self.config[uuid]
+        self.search_index.add(
+            uuid, [data["trigger"], str(data["emoji"]), uuid], getattr(self.emojis.get(uuid), "name", None)
+        )
+
+    def build_matchers(self):
+        """Rebuild the phrase matchers and regex scanners of every scope from the config, skipping dormant triggers."""
+        phrases = {}
+        patterns = {}
+        for uuid, data in self.config.items():
+            if uuid in self.dormant:
+                continue
+            scope = data.get("scope", GLOBAL_SCOPE)
+            if data["type"] == "phrase":
+                phrases.setdefault(scope, {})[uuid] = data["trigger"].lower()
+                continue
+            if data.get("disabled"):
+                continue
+            try:
+                compile(data["trigger"])
+            except re.error:  # Invalid regex in the config file
+                continue
+            patterns.setdefault(scope, {})[uuid] = data["trigger"]
+        self.phrase_matchers = {scope: PhraseMatcher(i) for scope, i in phrases.items()}
+        if patterns != self.regex_scanner.patterns or self.regex_scanner.pool is None:
+            self.regex_scanner.rebuild(patterns)
+
+    async def disable_slow_regexes(self, message: discord.Message):
+        """Find and disable the regex triggers that took too long to match a message, and report them."""
+        if self.finding_slow:  # Already looking, likely for the same triggers
+            return
+        self.finding_slow = True
+        try:
+            slow = await self.regex_scanner.find_slow(message.content, message_scopes(message))
+            slow = [uuid for uuid in slow if uuid in self.config]
+        finally:
+            self.finding_slow = False
+        if not slow:
+            return
+        for uuid in slow:
+            self.journal.set(
+                uuid, {
+                    **self.config[uuid],
+                    "disabled": f"Among the slowest regex triggers, which took longer than {REGEX_TIME_BUDGET}s "
+                                "together to match a message."
+                }
+            )
+        self.compile_triggers()
+
+        embed = discord.Embed(
+            title="Autoreact Regex Disabled",
+            description=f"Regex triggers took longer than {REGEX_TIME_BUDGET}s together to match [a message]"
+                        f"({message.jump_url}). The slowest have been disabled, so the others fit in time:\n" +
+                        "\n".join(f"`{uuid}`: `{self.config[uuid]['trigger']}`" for uuid in slow),
+            color=discord.Color.red()
+        )
+        log_channel = getattr(self.bot, "log_channel", None)
+        if log_channel is not None:
+            await log_channel.send(embed=embed)
 
     @commands.command(aliases=["aradd"])
     @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
-    async def autoreactadd(self, ctx: commands.Context, emoji: Union[discord.Emoji, str], *,
-                           phrase: str):
-        """Adds an autoreact based on a phrase match to the message, case-insensitive."""
+    async def autoreactadd(self, ctx: commands.Context, emoji: Union[discord.Emoji, str],
+                           scope: Optional[Scope] = None, *, phrase: str):
+        """
+        Adds an autoreact based on a phrase match to the message, case-insensitive.
+        Optionally limited to a scope: `channel:<channel>`, `category:<category>` or `guild:[guild]`.
+        """
         if isinstance(emoji, discord.Emoji) and not emoji.is_usable():
             return await ctx.reply("That emoji is not available to me.")
         elif isinstance(emoji, str):
@@ -36,22 +841,27 @@ class AutoReact(commands.Cog):
             except (TypeError, discord.errors.HTTPException):
                 return await ctx.reply("Invalid emoji.")
         uuid = str(uuid4())
-        self.config[uuid] = {
+        data = {
             "type": "phrase",
             "trigger": phrase,
             "emoji": emoji if isinstance(emoji, str) else emoji.id
         }
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.config, f)
+        if scope is not None:
+            data["scope"] = scope
+        self.journal.set(uuid, data)
+        self.compile_triggers()
+        self.index_trigger(uuid)
 
-        await ctx.reply(f"Added an autoreact for `{phrase}` with {emoji}, ID: *`{uuid}`*")
+        await ctx.reply(f"Added an autoreact for `{phrase}` with {emoji} {scope_label(scope or GLOBAL_SCOPE)}, "
+                        f"ID: *`{uuid}`*")
 
     @commands.command(aliases=["araddregex", "araddre"])
     @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
-    async def autoreactaddregex(self, ctx: commands.Context, emoji: Union[discord.Emoji, str], *,
-                                regex: str):
+    async def autoreactaddregex(self, ctx: commands.Context, emoji: Union[discord.Emoji, str],
+                                scope: Optional[Scope] = None, *, regex: str):
         """
         Adds an autoreact based on a regex match to the message, case-sensitive. This is done via partial match.
+        Optionally limited to a scope: `channel:<channel>`, `category:<category>` or `guild:[guild]`.
         Hope you know what you're doing...
         """
         if isinstance(emoji, discord.Emoji) and not emoji.is_usable():
@@ -63,26 +873,36 @@ class AutoReact(commands.Cog):
                 return await ctx.reply("Invalid emoji.")
         uuid = str(uuid4())
         try:
-            self.compiled_regexes[uuid] = compile(regex)
+            compile(regex)
         except Exception as e:
             return await ctx.reply(f"Invalid regex: `{repr(e)}`")
-        self.config[uuid] = {
+        reason = await self.regex_scanner.check(regex)
+        if reason is not None:
+            return await ctx.reply(f"That regex could freeze the bot: {reason}")
+        data = {
             "type": "regex",
             "trigger": regex,
             "emoji": emoji if isinstance(emoji, str) else emoji.id
         }
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.config, f)
+        if scope is not None:
+            data["scope"] = scope
+        self.journal.set(uuid, data)
+        self.compile_triggers()
+        self.index_trigger(uuid)
 
-        await ctx.reply(f"Added a regex autoreact for `{regex}` with {emoji}, ID: *`{uuid}`*")
+        await ctx.reply(f"Added a regex autoreact for `{regex}` with {emoji} {scope_label(scope or GLOBAL_SCOPE)}, "
+                        f"ID: *`{uuid}`*")
 
     @commands.command(aliases=["arremove", "ardelete"])
     @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
     async def autoreactremove(self, ctx: commands.Context, uuid):
         """Remove an autoreact based on its ID, obtainable via ?autoreactlist <emoji>"""
-        del self.config[uuid]
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.config, f)
+        if uuid not in self.config:
+            return await ctx.reply(f"No autoreact with ID `{uuid}` found.")
+        self.journal.delete(uuid)
+        self.compile_triggers()
+        self.search_index.remove(uuid)
+        self.stats.forget(uuid)
 
         await ctx.reply(f"Removed autoreact with ID `{uuid}`")
 
@@ -90,6 +910,7 @@ class AutoReact(commands.Cog):
     @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
     async def autoreactrefresh(self, ctx: commands.Context):
         """Refreshes the autoreact list from file"""
+        await self.journal.flush()  # Changes not written yet would be lost otherwise
         self.load_config()
         await ctx.reply("Refreshed autoreact list from file.")
 
@@ -102,71 +923,158 @@ class AutoReact(commands.Cog):
     @commands.command(aliases=["arsearch"])
     @checks.has_permissions(PermissionLevel.MODERATOR)
     async def autoreactsearch(self, ctx: commands.Context, *, query: Union[discord.Emoji, str]):
-        """Searches for an autoreact based on any field"""
+        """Searches for an autoreact by its trigger, emoji, emoji name (prefix) or ID, best matches first"""
         if isinstance(query, discord.Emoji):
             query = str(query.id)
 
-        matches = {}
-        for uuid, data in self.config.items():
-            if query in uuid:
-                matches[uuid] = data
-                continue
-            for field in data.values():
-                if query in str(field):
-                    matches[uuid] = data
-                    break
-
-        await self.send_list(ctx, matches)
+        matches = self.search_index.search(query, self.trigger_order)
+        await self.send_list(ctx, {uuid: self.config[uuid] for uuid in matches})
 
     @commands.command(aliases=["ararchive"])
     @checks.has_permissions(PermissionLevel.MODERATOR)
     async def autoreactarchive(self, ctx: commands.Context):
         """Archives the autoreact config file"""
+        await self.journal.flush(compact=True)  # Fold the journal in, so the file is complete
         await ctx.reply(file=discord.File(CONFIG_FILE))
 
+    @commands.Cog.listener("on_guild_emojis_update")
+    async def auto_react_on_guild_emojis_update(self, guild: discord.Guild, before: list, after: list):
+        """Update the emoji table for a guild's changed emojis, making triggers dormant or active again as needed."""
+        changed = False
+        after_ids = {emoji.id for emoji in after}
+        for emoji in before:
+            if emoji.id in after_ids:
+                continue
+            for uuid in self.emoji_triggers.get(emoji.id, []):  # Deleted
+                if uuid not in self.dormant:
+                    self.emojis.pop(uuid, None)
+                    self.dormant.add(uuid)
+                    changed = True
+        for emoji in after:
+            for uuid in self.emoji_triggers.get(emoji.id, []):  # Added (e.g. re-uploaded to another guild) or updated
+                self.emojis[uuid] = emoji
+                self.index_trigger(uuid)
+                if uuid in self.dormant:
+                    self.dormant.discard(uuid)
+                    changed = True
+        if changed:
+            self.build_matchers()
+
+    @commands.command(aliases=["ardiagnostics", "ardiag"])
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    async def autoreactdiagnostics(self, ctx: commands.Context):
+        """Lists autoreacts that aren't active: dormant ones (their emoji was deleted), and disabled regexes"""
+        await self.send_list(
+            ctx,
+            {uuid: data for uuid, data in self.config.items() if uuid in self.dormant or data.get("disabled")},
+            "No dormant or disabled autoreacts."
+        )
+
+    @commands.command(aliases=["arstats"])
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    async def autoreactstats(self, ctx: commands.Context, count: int = 10):
+        """Shows the most and least matched autoreacts, failed reactions, and how long matching a message takes"""
+        count = min(max(count, 1), 10)
+        ranked = sorted(self.config, key=lambda uuid: (-self.stats.hits[uuid], self.trigger_order[uuid]))
+
+        def describe(uuids) -> str:
+            return "\n".join(
+                f"`{uuid}`: `{self.config[uuid]['trigger'][:30]}` - {self.stats.hits[uuid]}" for uuid in uuids
+            ) or "None"
+
+        p50, p99 = self.stats.percentile(50), self.stats.percentile(99)
+        embed = discord.Embed(
+            title="Autoreact Stats",
+            description=f"Since <t:{int(self.stats.since)}:f>, {sum(self.stats.histogram)} messages checked",
+            color=discord.Color.blurple()
+        )
+        embed.add_field(name="Matcher p50", value="N/A" if p50 is None else f"≤{p50 * 1e6:.0f}µs")
+        embed.add_field(name="Matcher p99", value="N/A" if p99 is None else f"≤{p99 * 1e6:.0f}µs")
+        embed.add_field(
+            name="Failed Reactions",
+            value="\n".join(f"{reason}: {n}" for reason, n in self.stats.failures.most_common()) or "None"
+        )
+        embed.add_field(name="Top Triggers", value=describe(ranked[:count]), inline=False)
+        embed.add_field(name="Bottom Triggers", value=describe(ranked[::-1][:count]), inline=False)
+        await ctx.reply(embed=embed)
+
     @commands.Cog.listener("on_message")
     async def auto_react_on_message(self, message: discord.Message):
         if not message.author.guild or message.author.bot:
             return
+        start = time.perf_counter()
         content = message.content
-        for uuid, data in self.config.items():
-            if (data["type"] == "phrase" and data["trigger"].lower() in content.lower()) or \
-                    (data["type"] == "regex" and self.compiled_regexes[uuid].search(content)):
-                emoji = data["emoji"] if isinstance(data["emoji"], str) else self.bot.get_emoji(data["emoji"])
-                if emoji is not None:
+        scopes = message_scopes(message)
+        lowered = content.lower()
+        matches = set()
+        for scope in scopes:
+            if scope in self.phrase_matchers:
+                matches |= self.phrase_matchers[scope].search(lowered)
+        try:
+            matches |= await self.regex_scanner.scan(content, scopes)
+        except TimeoutError:  # Scan was killed, some regex is too slow
+            self.bot.loop.create_task(self.disable_slow_regexes(message))
+        except ProcessExpired:  # Worker died mid-scan, and will be replaced
+            traceback.print_exc()
+        self.stats.record_match(time.perf_counter() - start, matches)
+        emojis = {}  # Emoji (or custom emoji ID) -> emoji, so triggers sharing an emoji only react once
+        for uuid in sorted((i for i in matches if i in self.emojis), key=self.trigger_order.__getitem__):
+            emojis.setdefault(self.config[uuid]["emoji"], self.emojis[uuid])
+        if emojis:
+            self.bot.loop.create_task(self.dispatch_reactions(message, list(emojis.values())))
+
+    async def dispatch_reactions(self, message: discord.Message, emojis: list):
+        """React to a message with each emoji, in order. Requests for all messages share a bounded number of slots, and
+        discord.py waits out the rate limit of each route. The reactions of a single message share a route, so they're
+        sent one at a time (sending them at once would only scramble their order).
+
+        :param message: Message to react to
+        :param emojis: Unique emojis to react with
+        """
+        for emoji in emojis:
+            try:
+                async with self.reaction_semaphore:
                     await message.add_reaction(emoji)
+            except discord.NotFound:  # Unknown Message, deleted since
+                self.stats.record_failure("Message Deleted")
+                return
+            except discord.Forbidden:  # Can't react here (missing permissions, or blocked by the author)
+                self.stats.record_failure("Forbidden")
+                return
+            except discord.HTTPException as e:  # Anything else only affects this emoji
+                if e.code == 10014:  # Unknown Emoji (a 400, not a 404), deleted since, try the rest
+                    self.stats.record_failure("Unknown Emoji")
+                    continue
+                self.stats.record_failure("Other")
+                traceback.print_exc()
 
-    @staticmethod
-    async def send_list(ctx: commands.Context, autoreact: dict):
+    async def send_list(self, ctx: commands.Context, autoreact: dict, empty: str = "No autoreacts found."):
         if len(autoreact) == 0:
-            return await ctx.reply("No autoreacts found.")
-        embeds = []
-        for i in range(0, len(autoreact), 15):
-            embed = discord.Embed(
+            return await ctx.reply(empty)
+
+        def render(items: list) -> discord.Embed:
+            return discord.Embed(
                 title="Autoreact List",
                 description="\n".join(
-                    f"`{uuid}`: `{data['trigger']}` - {data['emoji'] if isinstance(data['emoji'], str) else ctx.bot.get_emoji(data['emoji'])}"
-                    for uuid, data in list(autoreact.items())[i:i + 15]
+                    f"`{uuid}`: `{data['trigger']}` - {self.emojis.get(uuid, data['emoji'])}"
+                    f"{' ' + scope_label(data['scope']) if 'scope' in data else ''}"
+                    f"{' *(dormant)*' if uuid in self.dormant else ''}{' *(disabled)*' if data.get('disabled') else ''}"
+                    for uuid, data in items
                 ),
                 color=discord.Color.blurple()
             )
-            embeds.append(embed)
 
         await Paginator.Simple(
             PreviousButton=discord.ui.Button(emoji="⬅️", style=discord.ButtonStyle.secondary),
             NextButton=discord.ui.Button(emoji="➡️", style=discord.ButtonStyle.secondary)
-        ).start(ctx, embeds)
+        ).start(ctx, ListPages(list(autoreact.items()), render))
 
     def load_config(self):
-        if not os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-        else:
-            with open(CONFIG_FILE, encoding="utf-8") as f:
-                self.config: dict = json.load(f)
-            for uuid, data in self.config.items():
-                if data["type"] == "regex":
-                    self.compiled_regexes[uuid] = compile(data["trigger"])
+        self.config = self.journal.load()
+        self.compile_triggers()
+        self.search_index = TriggerIndex()
+        for uuid in self.config:
+            self.index_trigger(uuid)
 
 
 async def setup(bot):
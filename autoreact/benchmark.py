@@ -0,0 +1,107 @@
+"""
+Offline benchmark for the autoreact plugin's phrase matching.
+
+Compares the PhraseMatcher automaton against checking every phrase one by one (like before it), on random phrase
+triggers and messages, and checks that both find the same matches. The plugin is imported with stand-ins for the modules
+Modmail provides (core and Paginator), so no bot is needed, only the plugin's requirements and discord.py.
+
+Usage:
+    python benchmark.py                                               # 5000 triggers, 200 messages of 300 characters
+    python benchmark.py --triggers 20000 --messages 500 --length 2000
+
+Exits with 1 if the automaton and the one by one check disagree on any message.
+"""
+
+import argparse
+import enum
+import os
+import random
+import string
+import sys
+import time
+import types
+
+# Stand-ins for the modules Modmail provides, which the plugin only uses to define and run its commands
+core = types.ModuleType("core")
+core.checks = types.ModuleType("core.checks")
+core.checks.has_permissions = lambda level: lambda command: command
+core.models = types.ModuleType("core.models")
+core.models.PermissionLevel = enum.IntEnum("PermissionLevel", "REGULAR SUPPORTER MODERATOR ADMINISTRATOR OWNER")
+sys.modules.update(
+    {"core": core, "core.checks": core.checks, "core.models": core.models, "Paginator": types.ModuleType("Paginator")}
+)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import autoreact  # noqa: E402
+
+
+def benchmark_phrases(triggers: int, messages: int, length: int, seed: int = 0) -> dict:
+    """Compare the PhraseMatcher against checking every phrase one by one, on random phrases and messages.
+
+    :param triggers: Number of phrase triggers
+    :param messages: Number of messages to match
+    :param length: Length of each message, in characters
+    :param seed: Random seed for the phrases and messages
+    :return: Results, with timings in seconds
+    """
+    rng = random.Random(seed)
+
+    def word():
+        return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8)))
+
+    phrases = {str(i): " ".join(word() for _ in range(rng.randint(1, 2))) for i in range(triggers)}
+    vocabulary = [word() for _ in range(500)] + list(phrases.values())[:50]
+    contents = []
+    for _ in range(messages):
+        content = ""
+        while len(content) < length:
+            content += rng.choice(vocabulary).upper() if rng.random() < 0.1 else rng.choice(vocabulary)
+            content += " "
+        contents.append(content[:length])
+
+    start = time.perf_counter()
+    matcher = autoreact.PhraseMatcher(phrases)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    naive = [{uuid for uuid, phrase in phrases.items() if phrase in content.lower()} for content in contents]
+    naive_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    automaton = [matcher.search(content.lower()) for content in contents]
+    automaton_time = time.perf_counter() - start
+
+    return {
+        "build": build,
+        "naive": naive_time / messages,
+        "automaton": automaton_time / messages,
+        "matches": sum(len(i) for i in automaton),
+        "mismatches": sum(a != b for a, b in zip(naive, automaton)),
+    }
+
+
+def report(results: dict):
+    """Print the results of a benchmark."""
+    print(f"Automaton build:      {results['build'] * 1000:.1f}ms")
+    print(f"One by one:           {results['naive'] * 1e6:.1f}us/message")
+    print(f"Automaton:            {results['automaton'] * 1e6:.1f}us/message")
+    print(f"Speedup:              {results['naive'] / results['automaton']:.1f}x")
+    print(f"Matches:              {results['matches']}")
+    print(f"Mismatches:           {results['mismatches']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline phrase matching benchmark for the autoreact plugin")
+    parser.add_argument("--triggers", type=int, default=5000, help="Number of phrase triggers")
+    parser.add_argument("--messages", type=int, default=200, help="Number of messages to match")
+    parser.add_argument("--length", type=int, default=300, help="Length of each message, in characters")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the phrases and messages")
+    args = parser.parse_args()
+
+    results = benchmark_phrases(args.triggers, args.messages, args.length, seed=args.seed)
+    report(results)
+    sys.exit(1 if results["mismatches"] else 0)
+
+
+if __name__ == "__main__":
+    main()
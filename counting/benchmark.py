@@ -0,0 +1,770 @@
+"""
+Offline replay benchmark for the counting plugin.
+
+Drives Counting's listeners (with raw event payloads for edits and deletes) using lightweight fake discord.py objects,
+replaying a JSONL trace of counting traffic, and reports throughput, per-message latency percentiles and the number of
+(simulated) API calls made. No network access or bot token is needed, only the plugin's requirements and discord.py.
+
+Usage:
+    python benchmark.py --synthetic 5000                 # Replay a generated trace
+    python benchmark.py --trace traffic.jsonl            # Replay a recorded trace
+    python benchmark.py --synthetic 5000 --save t.jsonl  # Save the generated trace for later comparisons
+    python benchmark.py --synthetic 5000 --no-delay      # Measure throughput, without the trace's delays
+    python benchmark.py --differential 100000            # Compare the expression engine against simpleeval
+    python benchmark.py --responsiveness                 # Check slow expressions don't block the event loop
+
+Trace format, one JSON object per line:
+    {"op": "send", "author": 1, "content": "42", "delay": 0.05}
+    {"op": "edit", "ref": 10, "content": "43", "delay": 0.05}  # ref is the line index of the message to edit/delete
+    {"op": "delete", "ref": 10, "delay": 0.05}
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from types import SimpleNamespace
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import counting  # noqa: E402
+import engine  # noqa: E402
+
+CHANNEL_ID = 1
+GUILD_ID = 2
+BOT_ID = 1_000_000  # Out of the range of trace authors, which are counted from 1
+API_LATENCY = 0.005  # Simulated time in seconds for a Discord API call
+TICK_INTERVAL = 0.01  # Time in seconds between ticks of the responsiveness check
+MAX_TICK_GAP = (
+    0.1  # Longest gap in seconds between ticks the responsiveness check allows
+)
+DIFFERENTIAL_REPEATS = 3  # Timed runs of each evaluator per expression in the differential, the fastest is kept
+DIFFERENTIAL_POOL_SAMPLE = (
+    1000  # Expressions of the differential also timed through the evaluator pool
+)
+SLOW_EXPRESSIONS = [
+    "round(7, -99999999999)",  # Never finishes, killed by the evaluator CPU limit (or timeout)
+    "+".join(
+        ["(9999**9999*999**9999)//(7**9999*3**9999)"] * 7
+    ),  # Over the engine's bounds, left to the pool
+]  # Expressions that take long (or forever) to evaluate, for the responsiveness check
+
+
+class FakeAPI:
+    """Counts simulated API calls, and simulates their latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def call(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, guild=None, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+        self.guild = guild
+        self.name = self.display_name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.display_avatar = SimpleNamespace(url="https://example.com/avatar.png")
+        self.roles = []
+
+
+class FakeReaction:
+    def __init__(self, emoji: str, me: bool):
+        self.emoji = emoji
+        self.me = me
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        api: FakeAPI,
+        message_id: int,
+        channel,
+        author: FakeUser,
+        content: str,
+        embed=None,
+    ):
+        self.api = api
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.attachments = []
+        self.reactions = []
+        self.reference = None
+        self.created_at = channel.clock()
+
+    async def add_reaction(self, emoji):
+        await self.api.call("add_reaction")
+        self.reactions.append(FakeReaction(emoji, True))
+
+    async def remove_reaction(self, emoji, member):
+        await self.api.call("remove_reaction")
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content=content, **kwargs)
+
+    async def delete(self, **kwargs):
+        await self.api.call("delete")
+        self.channel.messages.pop(self.id, None)
+
+    async def edit(self, **kwargs):
+        await self.api.call("edit")
+
+
+class FakeChannel:
+    def __init__(self, api: FakeAPI, bot_user: FakeUser):
+        self.api = api
+        self.id = CHANNEL_ID
+        self.guild = SimpleNamespace(id=GUILD_ID, filesize_limit=25 * 1024 * 1024)
+        self.mention = f"<#{CHANNEL_ID}>"
+        self.bot_user = bot_user
+        self.messages = {}
+        self.next_id = 1000
+        self.start = discord.utils.utcnow()
+        self.epoch = time.perf_counter()
+
+    def clock(self):
+        """Simulated time, so that trace delays line up with DUPLICATE_GRACE."""
+        return self.start + timedelta(seconds=time.perf_counter() - self.epoch)
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def add_user_message(self, author: FakeUser, content: str):
+        message = FakeMessage(self.api, self.new_id(), self, author, content)
+        self.messages[message.id] = message
+        return message
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await self.api.call("send")
+        message = FakeMessage(
+            self.api, self.new_id(), self, self.bot_user, content or "", embed
+        )
+        self.messages[message.id] = message
+        return message
+
+    async def delete_messages(self, messages):
+        await self.api.call("delete_messages")
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+    async def fetch_message(self, message_id):
+        await self.api.call("fetch_message")
+        try:
+            return self.messages[message_id]
+        except KeyError:
+            raise discord.NotFound(
+                SimpleNamespace(status=404, reason="Not Found"), "Unknown Message"
+            )
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or FakeMessage(
+            self.api, message_id, self, self.bot_user, ""
+        )
+
+    async def history(self, limit=100, oldest_first=False, after=None, **kwargs):
+        # Messages sent while the request is in flight aren't in the response
+        messages = [
+            m for m in self.messages.values() if after is None or m.id > after.id
+        ]
+        await self.api.call("history")
+        for message in sorted(messages, key=lambda m: m.id, reverse=not oldest_first)[
+            :limit
+        ]:
+            yield message
+
+
+class FakeBot:
+    def __init__(self, channel: FakeChannel, user: FakeUser):
+        self.channel = channel
+        self.user = user
+        self.loop = asyncio.get_running_loop()
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == self.channel.id else None
+
+    async def wait_until_ready(self):
+        return
+
+    def dispatch(self, *args, **kwargs):
+        return
+
+
+def synthetic_trace(length: int, authors: int = 8, seed: int = 0):
+    """Generate a synthetic trace of counting traffic: mostly correct counts (as digits or expressions), with chatter,
+    duplicates inside DUPLICATE_GRACE, edits, deletes, and the occasional wrong number.
+
+    :param length: Number of trace events to generate
+    :param authors: Number of distinct users counting
+    :param seed: Random seed, so traces are reproducible
+    :return: List of trace events
+    """
+    rng = random.Random(seed)
+    trace = []
+    number = 0
+    last_author = None
+    last_count_index = None
+    for i in range(length):
+        author = rng.choice([a for a in range(1, authors + 1) if a != last_author])
+        roll = rng.random()
+        delay = rng.uniform(0.0, 0.02)
+        if roll < 0.55:  # Plain count
+            number += 1
+            trace.append(
+                {"op": "send", "author": author, "content": str(number), "delay": delay}
+            )
+        elif roll < 0.75:  # Expression count
+            number += 1
+            a = rng.randint(1, max(1, number))
+            expression = rng.choice(
+                [
+                    f"{a}+{number - a}",
+                    f"({number}*2)//2",
+                    f"`{number - a} + {a}`",
+                    f"sqrt({number ** 2})",
+                ]
+            )
+            trace.append(
+                {"op": "send", "author": author, "content": expression, "delay": delay}
+            )
+        elif roll < 0.85:  # Chatter
+            trace.append(
+                {
+                    "op": "send",
+                    "author": author,
+                    "content": rng.choice(["hi", "lol", "nice", "who's next?"]),
+                    "delay": delay,
+                }
+            )
+            continue
+        elif roll < 0.9:  # Duplicate, inside the grace period
+            trace.append(
+                {"op": "send", "author": author, "content": str(number), "delay": 0.0}
+            )
+            continue
+        elif roll < 0.94 and last_count_index is not None:  # Edit the live count
+            trace.append(
+                {
+                    "op": "edit",
+                    "ref": last_count_index,
+                    "content": "edited",
+                    "delay": delay,
+                }
+            )
+            continue
+        elif roll < 0.97 and last_count_index is not None:  # Delete the live count
+            trace.append({"op": "delete", "ref": last_count_index, "delay": delay})
+            continue
+        else:  # Wrong number, ruins the count
+            trace.append(
+                {
+                    "op": "send",
+                    "author": author,
+                    "content": str(number + rng.randint(2, 9)),
+                    "delay": delay,
+                }
+            )
+            number = 0
+            last_author = None
+            last_count_index = None
+            continue
+        last_author = author
+        last_count_index = i
+    return trace
+
+
+async def replay(trace: list, latency: float, settings: dict, delays: bool = True):
+    """Replay a trace against a fresh Counting cog.
+
+    :param trace: List of trace events
+    :param latency: Simulated API latency in seconds
+    :param settings: Channel settings to use (see Counting.load_config)
+    :param delays: Whether to sleep for the trace's delays, which then bound the throughput. Without them, all the
+        messages are sent within DUPLICATE_GRACE of each other.
+    :return: Results dict
+    """
+    api = FakeAPI(latency)
+    bot_user = FakeUser(BOT_ID, bot=True)
+    channel = FakeChannel(api, bot_user)
+    guild = channel.guild
+    users = {}
+    bot = FakeBot(channel, bot_user)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        counting.CONFIG_FILE = os.path.join(tmp, "config.json")
+        counting.CHECKPOINT_FILE = os.path.join(tmp, "checkpoint.json")
+        counting.STATS_FILE = os.path.join(tmp, "stats.db")
+        counting.DELETABLE_FILE = os.path.join(tmp, "deletable.json")
+        counting.write_json_atomic(
+            counting.CONFIG_FILE, {"channels": {str(CHANNEL_ID): settings}}
+        )
+        cog = counting.Counting(bot)
+        await asyncio.sleep(0)  # Let async_init run
+        while any(state.channel is None for state in cog.states.values()):
+            await asyncio.sleep(0.01)
+        api.calls.clear()
+
+        sent = {}  # Trace index -> message
+        latencies = []
+        tasks = []
+
+        async def timed(handler, *args):
+            start = time.perf_counter()
+            await handler(*args)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for index, event in enumerate(trace):
+            if not delays:  # Still let the handlers interleave with new events
+                await asyncio.sleep(0)
+            elif event.get("delay"):
+                await asyncio.sleep(event["delay"])
+            if event["op"] == "send":
+                author = users.setdefault(
+                    event["author"], FakeUser(event["author"], guild)
+                )
+                message = sent[index] = channel.add_user_message(
+                    author, event["content"]
+                )
+                tasks.append(
+                    asyncio.create_task(timed(cog.counting_on_message, message))
+                )
+            elif event["op"] in ("edit", "delete") and event.get("ref") in sent:
+                message = sent[event["ref"]]
+                if event["op"] == "edit":
+                    # Edit a copy, the handler of the message may not have read it yet (without delays)
+                    if message.id in channel.messages:
+                        channel.messages[message.id] = copy.copy(message)
+                        channel.messages[message.id].content = event["content"]
+                    payload = SimpleNamespace(
+                        channel_id=CHANNEL_ID,
+                        message_id=message.id,
+                        data={
+                            "content": event["content"],
+                            "edited_timestamp": channel.clock().isoformat(),
+                        },
+                    )
+                    tasks.append(
+                        asyncio.create_task(
+                            timed(cog.counting_on_message_edit, payload)
+                        )
+                    )
+                else:
+                    channel.messages.pop(message.id, None)
+                    payload = SimpleNamespace(
+                        channel_id=CHANNEL_ID,
+                        message_id=message.id,
+                        cached_message=None,
+                    )
+                    tasks.append(
+                        asyncio.create_task(
+                            timed(cog.counting_on_message_delete, payload)
+                        )
+                    )
+        await asyncio.gather(*tasks)
+        handled = time.perf_counter() - start
+        for state in cog.states.values():
+            cog.flush_chatter(state)
+            await state.drain()
+        total = time.perf_counter() - start
+        await cog.cog_unload()
+        state = cog.states[CHANNEL_ID]
+
+    return {
+        "events": len(latencies),
+        "delays": delays,
+        "handled_seconds": handled,
+        "total_seconds": total,
+        "latencies": latencies,
+        "api_calls": dict(api.calls),
+        "final_count": state.last_number,
+        "reactions_saved": state.reactions_saved,
+        "evaluation_paths": dict(counting.evaluation_paths),
+        "cache": counting.evaluation_cache.stats(),
+    }
+
+
+def expression_corpus(size: int, seed: int = 0):
+    """Generate a corpus of random expressions for differential testing: mostly valid arithmetic using the plugin's
+    operators, functions and names, mixed with unknown names and functions, removed operators, chatter and syntax errors.
+
+    :param size: Number of expressions to generate
+    :param seed: Random seed, so corpora are reproducible
+    :return: List of expressions
+    """
+    rng = random.Random(seed)
+    names = sorted(engine.s.names) + ["x", "hi"]
+    functions = sorted(engine.ENGINE_FUNCTIONS) + ["str", "foo", "rand"]
+    operators = ["+", "-", "*", "/", "//", "%", "**"]
+    rare_operators = [
+        "^",
+        "|",
+        "&",
+        "<<",
+        "<",
+        "==",
+    ]  # Removed or outside the engine's grammar
+
+    def number():
+        return rng.choice(
+            [
+                str(rng.randint(0, 10)),
+                str(rng.randint(0, 10000)),
+                str(rng.randint(0, 10**30)),
+                f"{rng.uniform(0, 100):.{rng.randint(0, 3)}f}",
+                rng.choice(
+                    [
+                        "1_000",
+                        "0x1f",
+                        "1e3",
+                        "2.5e-3",
+                        "0",
+                        "00",
+                        "007",
+                        "1.",
+                        ".5",
+                        "1__0",
+                        "10000",
+                        "9999",
+                    ]
+                ),
+            ]
+        )
+
+    def expression(depth: int):
+        roll = rng.random()
+        if depth <= 0 or roll < 0.3:
+            return rng.choice(names) if rng.random() < 0.1 else number()
+        elif roll < 0.4:
+            return f"{rng.choice(['-', '-', '-', '+', '~', 'not '])}{expression(depth - 1)}"
+        elif roll < 0.85:
+            operator = rng.choice(rare_operators if rng.random() < 0.1 else operators)
+            return f"({expression(depth - 1)} {operator} {expression(depth - 1)})"
+        function = rng.choice(functions)
+        args = [expression(depth - 1) for _ in range(rng.randint(0, 2))]
+        if function == "log" and rng.random() < 0.5:
+            args = [expression(depth - 1), f"base={expression(depth - 1)}"]
+        return f"{function}({', '.join(args)})"
+
+    corpus = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.05:
+            corpus.append(
+                rng.choice(
+                    [
+                        "hello there",
+                        "lol",
+                        "?",
+                        "who's next",
+                        "",
+                        "x = 5",
+                        "1; 2",
+                        "'a' * 3",
+                    ]
+                )
+            )
+        elif roll < 0.1:
+            corpus.append(
+                expression(rng.randint(0, 3)) + rng.choice(["(", ")", "=", ",", " 1"])
+            )
+        else:
+            corpus.append(expression(rng.randint(0, 4)))
+    return corpus
+
+
+def same_result(a, b):
+    """Check whether two evaluation results (see engine.safe_eval) would be treated the same by the plugin."""
+    if a[0] is Exception or b[0] is Exception:
+        return a == b
+    if (
+        isinstance(a[0], float)
+        and isinstance(b[0], float)
+        and math.isnan(a[0])
+        and math.isnan(b[0])
+    ):
+        return True
+    return type(a[0]) is type(b[0]) and a[0] == b[0]
+
+
+def differential(corpus: list):
+    """Evaluate a corpus with both the expression engine and simpleeval (in-process), checking that every expression
+    the engine supports gets the same result (and error message), and timing both (fastest of DIFFERENTIAL_REPEATS),
+    as well as a sample through the evaluator pool.
+
+    :param corpus: List of expressions
+    :return: Results dict
+    """
+    mismatches = []
+    engine_latencies = []
+    simpleeval_latencies = []
+    supported = []
+    unsupported = 0
+    for expression in corpus:
+        engine_result = engine.engine_eval(expression)
+        if engine_result is None:  # Goes to the evaluator pool, which runs simpleeval
+            unsupported += 1
+            continue
+        supported.append(expression)
+        simpleeval_result = engine.safe_eval(expression)
+        if not same_result(engine_result, simpleeval_result):
+            mismatches.append((expression, engine_result, simpleeval_result))
+        # Timed separately, as whichever evaluator runs first on an expression is penalised (cold caches)
+        engine_times, simpleeval_times = [], []
+        for _ in range(DIFFERENTIAL_REPEATS):
+            start = time.perf_counter()
+            engine.engine_eval(expression)
+            engine_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            engine.safe_eval(expression)
+            simpleeval_times.append(time.perf_counter() - start)
+        engine_latencies.append(min(engine_times))
+        simpleeval_latencies.append(min(simpleeval_times))
+    return {
+        "expressions": len(corpus),
+        "unsupported": unsupported,
+        "mismatches": mismatches,
+        "engine_latencies": engine_latencies,
+        "simpleeval_latencies": simpleeval_latencies,
+        "pool_latencies": asyncio.run(
+            pool_latencies(supported[:DIFFERENTIAL_POOL_SAMPLE])
+        ),
+    }
+
+
+async def pool_latencies(expressions: list):
+    """Time expressions through the evaluator pool, which is what they'd go through without the engine.
+
+    :param expressions: Expressions to evaluate
+    :return: List of latencies in seconds
+    """
+    counting.evaluator.start()
+    await asyncio.sleep(0.5)  # Let the workers spawn
+    latencies = []
+    try:
+        for expression in expressions:
+            start = time.perf_counter()
+            await counting.evaluator.evaluate(expression)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        pool = counting.evaluator.pool
+        counting.evaluator.stop()
+        pool.join()
+    return latencies
+
+
+def report_differential(results: dict):
+    """Print the results of a differential run."""
+    print(f"Expressions:          {results['expressions']}")
+    print(f"Left to simpleeval:   {results['unsupported']}")
+    print(f"Mismatches:           {len(results['mismatches'])}")
+    for expression, engine_result, simpleeval_result in results["mismatches"][:10]:
+        print(
+            f"    {expression!r}: engine {engine_result!r}, simpleeval {simpleeval_result!r}"
+        )
+    for name in ("engine", "simpleeval", "pool"):
+        latencies = results[f"{name}_latencies"]
+        if not latencies:
+            continue
+        print(
+            f"Latency ({name + '):':<12} mean {sum(latencies) / len(latencies) * 1e6:.1f}us, "
+            + ", ".join(
+                f"p{pct} {counting.percentile(latencies, pct) * 1e6:.1f}us"
+                for pct in (50, 90, 99)
+            )
+        )
+
+
+async def responsiveness(expressions: list):
+    """Evaluate slow expressions through evaluate_message (like real counts) while a ticker runs on the event loop, and
+    measure the longest gap between ticks. Evaluation must never block the loop, so other coroutines keep running.
+
+    :param expressions: Expressions to evaluate
+    :return: Results dict
+    """
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(TICK_INTERVAL)
+
+    counting.evaluator.start()
+    await asyncio.sleep(0.5)  # Let the workers spawn
+    results = []
+    try:
+        for expression in expressions:
+            ticks.clear()
+            task = asyncio.create_task(ticker())
+            await asyncio.sleep(0)  # First tick
+            start = time.perf_counter()
+            number, notices = await counting.evaluate_message(
+                SimpleNamespace(content=expression)
+            )
+            elapsed = time.perf_counter() - start
+            task.cancel()
+            ticks.append(time.perf_counter())
+            gap = max(b - a for a, b in zip(ticks, ticks[1:]))
+            results.append(
+                {
+                    "expression": expression,
+                    "seconds": elapsed,
+                    "ticks": len(ticks) - 1,
+                    "max_gap": gap,
+                    "result": (
+                        number
+                        if number is not None
+                        else (notices[0]["content"] if notices else None)
+                    ),
+                }
+            )
+    finally:
+        pool = counting.evaluator.pool
+        counting.evaluator.stop()
+        pool.join()  # Workers replaced after a timeout could outlive the pool otherwise, and hang the exit
+    return results
+
+
+def report_responsiveness(results: list):
+    """Print the results of a responsiveness check.
+
+    :return: Whether every expression kept the event loop responsive
+    """
+    ok = True
+    for result in results:
+        passed = result["max_gap"] <= MAX_TICK_GAP
+        ok &= passed
+        if isinstance(
+            result["result"], int
+        ):  # Could be too large to convert to a string
+            summary = f"{result['result'].bit_length()}-bit integer"
+        else:
+            summary = str(result["result"]).splitlines()[0]
+        print(
+            f"{'ok  ' if passed else 'FAIL'} {result['expression'][:60]!r}: {result['seconds'] * 1000:.0f}ms, "
+            f"{result['ticks']} ticks, max gap {result['max_gap'] * 1000:.1f}ms, result {summary!r}"
+        )
+    return ok
+
+
+def report(results: dict):
+    """Print the results of a replay."""
+    latencies = results["latencies"]
+    print(f"Events replayed:      {results['events']}")
+    print(f"Final count:          {results['final_count']}")
+    print(
+        f"Throughput (handled): {results['events'] / results['handled_seconds']:.1f} events/s"
+    )
+    print(
+        f"Throughput (drained): {results['events'] / results['total_seconds']:.1f} events/s"
+    )
+    if results["delays"]:
+        print(
+            "                      (bound by the trace's delays, use --no-delay to measure it)"
+        )
+    for pct in (50, 90, 99, 100):
+        print(
+            f"Latency p{pct:<3}         {counting.percentile(latencies, pct) * 1000:.2f}ms"
+        )
+    print(
+        f"API calls:            {sum(results['api_calls'].values())} {results['api_calls']}"
+    )
+    print(f"Reactions saved:      {results['reactions_saved']}")
+    print(f"Evaluation paths:     {results['evaluation_paths']}")
+    print(f"Evaluation cache:     {results['cache']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline replay benchmark for the counting plugin"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--trace", help="JSONL trace file to replay")
+    source.add_argument(
+        "--synthetic",
+        type=int,
+        help="Generate and replay a synthetic trace of this many events",
+    )
+    source.add_argument(
+        "--differential",
+        type=int,
+        help="Compare the expression engine against simpleeval on this many expressions",
+    )
+    source.add_argument(
+        "--responsiveness",
+        action="store_true",
+        help="Check that slow expressions don't block the event loop (exits with 1 if they do)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed for synthetic traces and corpora",
+    )
+    parser.add_argument("--save", help="Save the (synthetic) trace to this file")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=API_LATENCY,
+        help="Simulated API latency in seconds",
+    )
+    parser.add_argument(
+        "--speed-mode", action="store_true", help="Replay with speed mode enabled"
+    )
+    parser.add_argument(
+        "--coalesce", action="store_true", help="Replay with chatter coalescing enabled"
+    )
+    parser.add_argument(
+        "--no-delay",
+        action="store_true",
+        help="Replay without sleeping for the trace's delays, to measure throughput",
+    )
+    args = parser.parse_args()
+
+    if args.differential:
+        corpus = expression_corpus(args.differential, seed=args.seed)
+        results = differential(corpus)
+        report_differential(results)
+        sys.exit(1 if results["mismatches"] else 0)
+
+    if args.responsiveness:
+        sys.exit(
+            0
+            if report_responsiveness(asyncio.run(responsiveness(SLOW_EXPRESSIONS)))
+            else 1
+        )
+
+    if args.trace:
+        with open(args.trace, encoding="utf-8") as f:
+            trace = [json.loads(line) for line in f if line.strip()]
+    else:
+        trace = synthetic_trace(args.synthetic, seed=args.seed)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(event) + "\n" for event in trace)
+
+    settings = {"speed_mode": args.speed_mode, "coalesce": args.coalesce}
+    report(asyncio.run(replay(trace, args.latency, settings, delays=not args.no_delay)))
+
+
+if __name__ == "__main__":
+    main()
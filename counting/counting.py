@@ -1,76 +1,97 @@
-import ast
 import asyncio
+import functools
+import json
 import math
-import operator as op
+import os
 import re
+import signal
+import sqlite3
+import tempfile
+import time
+import traceback
 import warnings
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
 from concurrent.futures import TimeoutError
 
 import discord
 import simpleeval
 from discord.ext import commands
-from pebble import concurrent
+from pebble import ProcessExpired, ProcessPool
 
-VERSION = "2.1.1"
+try:
+    from .engine import TOO_MUCH_MATH, TOO_MUCH_MEMORY, engine_eval, s, safe_eval
+except ImportError:  # Loaded as a top-level module (e.g. by benchmark.py)
+    from engine import TOO_MUCH_MATH, TOO_MUCH_MEMORY, engine_eval, s, safe_eval
+
+try:
+    import resource
+except (
+    ImportError
+):  # Not available on Windows, evaluators will run without OS-level limits
+    resource = None
+
+VERSION = "2.2.0"
 COUNTING_CHANNEL = 1162804188800102501
 DEVELOPER_ROLE = 1087928500893265991
 EVALUATION_TIMEOUT = 2  # Time in seconds after which to timeout
+EVALUATOR_WORKERS = 2  # Number of pre-warmed evaluator processes kept alive
+EVALUATOR_MAX_TASKS = (
+    500  # Number of evaluations a worker performs before being recycled
+)
+EVALUATOR_LATENCY_SAMPLES = 1000  # Number of recent evaluation latencies kept for stats
+EVALUATOR_MEMORY_LIMIT = (
+    256 * 1024 * 1024
+)  # Address space in bytes an evaluator may use on top of what it inherits from the bot
+EVALUATOR_CPU_LIMIT = 0.5  # Min CPU time in seconds an evaluation may use before the evaluator is killed (rounded up
+#  to a whole second of the worker's total, so at most 1.5s, always under EVALUATION_TIMEOUT so the kill can happen)
+EVALUATOR_NICE = (
+    10  # Niceness increment for evaluators, so expressions don't starve the bot itself
+)
+EVALUATION_CACHE_SIZE = 1024  # Number of evaluated expressions to remember
 DUPLICATE_GRACE = 1  # Time in seconds to be lenient to duplicate messages
+SPEED_MODE_WINDOW = 10  # Time in seconds between success reactions in speed mode
+SPEED_MODE_MILESTONE = 100  # Counts that are a multiple of this always get a success reaction in speed mode
+CHATTER_COALESCE_WINDOW = 3  # Time in seconds to collect non-number messages for, before resending them together
+CHATTER_COALESCE_MAX = (
+    10  # Max messages resent together (Discord allows up to 10 embeds per message)
+)
+EMBED_DESCRIPTION_LIMIT = 4096  # Max characters in an embed description
+EMBEDS_TOTAL_LIMIT = 6000  # Max characters across all embeds of a message
+CONTENT_LIMIT = 2000  # Max characters in message content
+ATTACHMENT_FILE_CAP = (
+    8 * 1024 * 1024
+)  # Max size in bytes of a single resent attachment, larger ones are linked instead of re-uploaded
+ATTACHMENT_TOTAL_BUDGET = (
+    16 * 1024 * 1024
+)  # Max total size in bytes of attachments re-uploaded per resent message
+AUDIT_PAGE_SIZE = 100  # Messages fetched and evaluated per batch in audits
+AUDIT_CONCURRENCY = 8  # Max evaluations in flight at once in audits
+AUDIT_PROGRESS_INTERVAL = 5  # Time in seconds between audit progress updates
+CONFIG_FILE = (
+    os.path.dirname(__file__) + "/config.json"
+)  # Counting channels, configurable at runtime
+STATS_FILE = (
+    os.path.dirname(__file__) + "/stats.db"
+)  # SQLite database of counting stats (counts/fails per user, highest count, streak)
+STATS_FLUSH_INTERVAL = 30  # Time in seconds between writes of counting stats to disk
+DELETABLE_FILE = (
+    os.path.dirname(__file__) + "/deletable.json"
+)  # Index of user-deletable bot messages, so 🗑️ reactions work on uncached messages (and across restarts)
+DELETABLE_INDEX_SIZE = (
+    10000  # Number of most recently used deletable messages to remember
+)
+CHECKPOINT_FILE = (
+    os.path.dirname(__file__) + "/checkpoint.json"
+)  # Last accepted count, for instant recovery on startup
 CODE_BLOCK_REGEX = re.compile(
     r"(?P<delim>(?P<block>```)|``?)(?(block)(?:(?P<lang>[a-z]+)\n)?)(?:[ \t]*\n)*(?P<code>.*?)\s*(?P=delim)",
     re.DOTALL | re.IGNORECASE,
 )  # Regex to detect and extra code from Discord code blocks
 
-# Create and configure SimpleEval parser to handle expressions
-s = simpleeval.SimpleEval()
-del s.operators[
-    ast.BitXor
-]  # ^ symbol, which people may confuse for ** (would override, but syntax is slightly diff)
-del s.operators[ast.BitOr]  # | symbol, which people may confuse for abs
-del s.functions[
-    "rand"
-]  # Randomly generates numbers, would cause griefs more often than not
-del s.functions[
-    "randint"
-]  # Randomly generates numbers, would cause griefs more often than not
-s.functions.update(  # Add additional functions
-    floor=math.floor,
-    rounddown=math.floor,
-    round_down=math.floor,
-    ceil=math.ceil,
-    roundup=math.ceil,
-    round_up=math.ceil,
-    round=round,
-    sqrt=math.sqrt,
-    sqroot=math.sqrt,
-    squareroot=math.sqrt,
-    sin=lambda x: math.sin(
-        math.radians(x)
-    ),  # sin takes radians, input as degrees is simpler, so convert deg -> rad
-    cos=lambda x: math.cos(
-        math.radians(x)
-    ),  # cos takes radians, input as degrees is simpler, so convert deg -> rad
-    tan=lambda x: math.tan(
-        math.radians(x)
-    ),  # tan takes radians, input as degrees is simpler, so convert deg -> rad
-    degrees=math.degrees,  # Offer rad -> deg conversion
-    radians=math.radians,  # Offer deg -> rad conversion
-    abs=abs,
-    bitxor=op.xor,  # Reimplement bitwise XOR (^), which was removed to curb symbol confusion
-    bitor=op.or_,  # Reimplement bitwise OR (|), which was removed to curb symbol confusion,
-    log=lambda x, base=10: math.log(x, base),  # Log with default base 10
-    ln=math.log,  # Default math.log (base e)
-)
-s.names.update(  # Add additional variables
-    pi=math.pi,
-    e=math.e,
-)
-simpleeval.MAX_POWER = (
-    10000  # We're never getting that far (prevents timely exponent operations)
-)
-simpleeval.MAX_STRING_LENGTH = (
-    10000  # Shouldn't be using strings much anyway (prevents memory exhaustion)
-)
+# Functions whose results can differ between calls with the same input (in case they are ever re-added), expressions
+# using them are never cached
+UNCACHEABLE_REGEX = re.compile(r"\b(?:rand|randint)\b")
 
 
 def set_embed_author(embed: discord.Embed, member: discord.Member) -> discord.Embed:
@@ -113,6 +134,35 @@ def set_embed_author_footer(
     return set_embed_footer(set_embed_author(embed, member), additional)
 
 
+def write_json_atomic(path: str, data):
+    """Write JSON data to a file atomically (write to a temporary file, then replace), so a crash mid-write can never
+    leave a corrupted file behind. Blocking, run via asyncio.to_thread.
+
+    :param path: Path of the file to write
+    :param data: Data to write, must be JSON-serializable
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_json(path: str, default=None):
+    """Read JSON data from a file. Blocking, run via asyncio.to_thread.
+
+    :param path: Path of the file to read
+    :param default: Value to return if the file doesn't exist or is unreadable
+    :return: Data read from the file, or default
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
 def get_exp_code(exp):
     """Place an expression into a code-block, escaping as needed."""
     return f"```py\n{exp.replace('`', '[backtick]')}\n```"
@@ -143,76 +193,269 @@ async def expression_reply(
     )
 
 
-@concurrent.process(timeout=EVALUATION_TIMEOUT)
-def safe_eval(string: str):
-    """Safely run simpleeval's parser, with a backup timeout (via Pebble). It also generates and returns the
-    appropriate user-facing message for an exception.
+def _address_space_size():
+    """Get the current address space size of this process in bytes, None if it can't be determined."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
 
-    :param string: String to evaluate (passed into simpleeval)
-    :return: If successful, (result, warnings). If unsuccessful, (Exception, fail_msg)
-    :raises concurrent.futures.TimeoutError: Exception raised upon timeout
+
+def _warm_evaluator():
+    """Pool initializer, run in every new evaluator process. Applies OS-level resource limits (where supported), and
+    warms up the evaluator so the first real expression doesn't pay for it."""
+    try:
+        os.nice(EVALUATOR_NICE)
+    except (AttributeError, OSError):
+        pass
+    if resource is not None:
+        size = _address_space_size()
+        if (
+            size is not None
+        ):  # Limit is relative, as evaluators inherit the bot's memory when forked
+            _, hard = resource.getrlimit(resource.RLIMIT_AS)
+            limit = size + EVALUATOR_MEMORY_LIMIT
+            if hard != resource.RLIM_INFINITY:
+                limit = min(limit, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    with warnings.catch_warnings(record=True):
+        s.eval("1+1")
+
+
+def _pool_eval(string: str):
+    """Worker-side wrapper around safe_eval, also returning the worker PID so the pool can track recycles. Sets the CPU
+    time limit for this evaluation (the limit is cumulative over the worker's life, and in whole seconds, so it's moved
+    up to the first whole second at least EVALUATOR_CPU_LIMIT away every time)."""
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        limit = math.ceil(usage.ru_utime + usage.ru_stime + EVALUATOR_CPU_LIMIT)
+        if hard == resource.RLIM_INFINITY or limit <= hard:
+            resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    return os.getpid(), safe_eval(string)
+
+
+def percentile(values, pct: float):
+    """Get the pct-th percentile (0-100) of a collection of values, using the nearest-rank method.
+
+    :param values: Values to get the percentile of
+    :param pct: Percentile to get
+    :return: Percentile value, None if there are no values
     """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[
+        min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    ]
 
-    # We generate fail_msg's here, as opposed to relaying the exception, because certain exceptions
-    # (e.g. FunctionNotDefined & OperatorNotDefined) cannot be pickled, and results in another error when we try to
-    # relay it back (really confusing one at that). It's simpler to just handle all message generation logic here.
 
-    fail_msg = None
-    try:
-        with warnings.catch_warnings(record=True) as ws:
-            return s.eval(string), ws
-    except TimeoutError:
-        fail_msg = (
-            "Too much math!\n*(Something in your expression is taking too long to evaluate)*\n\n"
-            "**If you are seeing this message, please report the expression you used to the bot development team.**"
-        )
-    except simpleeval.NumberTooHigh:
-        fail_msg = (
-            "Why don't you try and calculate that?\n*(A number in your expression is too big -- "
-            "some operations have size limits to prevent time-expensive operations)*"
-        )
-    except simpleeval.IterableTooLong:
-        fail_msg = (
-            "An iterable in your expression is way too big -- there are size limits to prevent "
-            "memory-expensive operations"
-        )
-    except simpleeval.FunctionNotDefined as e:
-        fail_msg = f"The function `{getattr(e, 'func_name').replace('`', '[backtick]')}` does not exist."
-    except simpleeval.OperatorNotDefined as e:
+class EvaluatorPool:
+    """Pool of persistent, pre-warmed evaluator processes that run safe_eval, with a per-expression timeout.
+    Workers are recycled after a set amount of evaluations, or replaced if killed by a timeout.
+    """
+
+    def __init__(self, workers: int, max_tasks: int, timeout: float):
+        self.workers = workers
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+        self.pool = None
+        self.pending = 0  # Evaluations submitted, but not yet finished (queue depth)
+        self.completed = 0
+        self.timeouts = 0
+        self.memory_limit_hits = (
+            0  # Evaluations that ran out of memory (the worker survives these)
+        )
+        self.cpu_limit_kills = (
+            0  # Workers killed by the kernel for exceeding the CPU time limit
+        )
+        self.crashes = 0
+        self.pids = (
+            set()
+        )  # Every worker PID seen, new PIDs past the initial workers are recycles
+        self.latencies = deque(maxlen=EVALUATOR_LATENCY_SAMPLES)
+
+    def start(self):
+        """Start the pool (if not already running), and warm up every worker."""
+        if self.pool is not None and self.pool.active:
+            return
+        self.pool = ProcessPool(
+            max_workers=self.workers,
+            max_tasks=self.max_tasks,
+            initializer=_warm_evaluator,
+        )
+        for _ in range(
+            self.workers
+        ):  # Forces the workers to spawn now, rather than on the first count
+            self.pool.schedule(os.getpid)
+
+    def stop(self):
+        """Stop the pool, killing any running evaluations."""
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    async def evaluate(self, string: str):
+        """Evaluate a string in the pool without blocking the event loop, see safe_eval.
+
+        :param string: String to evaluate
+        :return: If successful, (result, warnings). If unsuccessful, (Exception, fail_msg)
+        """
+        self.start()
+        self.pending += 1
+        start = time.perf_counter()
         try:
-            op_name = e.attr.__class__.__name__
-            fail_msg = f"The operator `{op_name}` does not exist."
-            if op_name == "BitXor":
-                fail_msg += "\nTo perform a power operation, use `**` instead of `^`."
-            elif op_name == "BitOr":
-                fail_msg += "\nTo get an absolute value, use `abs(content here)` instead of `|content here|`."
-        except (Exception,):
-            fail_msg = None
-    except (SyntaxError, ValueError, TypeError, ZeroDivisionError) as e:
-        err_str = str(e)
-        if err_str.startswith(
-            "invalid syntax"
-        ):  # False-positives from messages starting with most symbols (?abc)
-            pass
-        else:
-            fail_msg = f"```py\n{repr(e).replace('`', '[backtick]')}\n```"
-    except (Exception,):
-        pass
+            pid, result = await asyncio.wrap_future(
+                self.pool.schedule(_pool_eval, args=(string,), timeout=self.timeout)
+            )
+            self.pids.add(pid)
+            if result[0] is Exception and result[1] == TOO_MUCH_MEMORY:
+                self.memory_limit_hits += 1
+        except TimeoutError:  # Worker was killed by the pool, and will be replaced
+            self.timeouts += 1
+            result = Exception, TOO_MUCH_MATH
+        except ProcessExpired as e:  # Worker died mid-evaluation, and will be replaced
+            if hasattr(signal, "SIGXCPU") and e.exitcode == -signal.SIGXCPU:
+                self.cpu_limit_kills += 1
+            else:
+                self.crashes += 1
+            result = Exception, TOO_MUCH_MATH
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def stats(self) -> dict:
+        """Get statistics about the pool, for diagnostic purposes."""
+        return {
+            "Queue Depth": self.pending,
+            "Evaluations": self.completed,
+            "Timeouts": self.timeouts,
+            "Memory Limit Hits": self.memory_limit_hits,
+            "CPU Limit Kills": self.cpu_limit_kills,
+            "Crashes": self.crashes,
+            "Recycled Workers": max(0, len(self.pids) - self.workers),
+            "Latency p50": percentile(self.latencies, 50),
+            "Latency p99": percentile(self.latencies, 99),
+        }
+
+
+class EvaluationCache:
+    """Size-bounded LRU cache of evaluation results, keyed on the expression text."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cacheable(string: str, result: tuple) -> bool:
+        """Check whether an evaluation result can be cached. Results of non-deterministic expressions, and failures
+        caused by the evaluator itself (e.g. timeouts, which depend on load) are never cached.
+
+        :param string: Expression that was evaluated
+        :param result: Result from safe_eval
+        :return: Whether the result can be cached
+        """
+        if result[0] is Exception and result[1] in (TOO_MUCH_MATH, TOO_MUCH_MEMORY):
+            return False
+        return not UNCACHEABLE_REGEX.search(string)
 
-    return Exception, fail_msg
+    def get(self, string: str):
+        """Get the cached result of an expression, see safe_eval.
 
+        :param string: Expression to get the result of
+        :return: Cached result, None if not cached
+        """
+        result = self.results.get(string)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.results.move_to_end(string)
+        return result
 
-async def get_num(message: discord.Message, reply: bool = False):
-    """Get a number from a user input, potentially containing mathematical expressions.
+    def put(self, string: str, result: tuple):
+        """Cache the result of an expression, if it's cacheable, evicting the least recently used entry if full.
+
+        :param string: Expression that was evaluated
+        :param result: Result from safe_eval
+        """
+        if not self.cacheable(string, result):
+            return
+        self.results[string] = result
+        self.results.move_to_end(string)
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Get statistics about the cache, for diagnostic purposes."""
+        return {
+            "Cache Size": f"{len(self.results)}/{self.size}",
+            "Cache Hits": self.hits,
+            "Cache Misses": self.misses,
+        }
+
+
+evaluator = EvaluatorPool(EVALUATOR_WORKERS, EVALUATOR_MAX_TASKS, EVALUATION_TIMEOUT)
+evaluation_cache = EvaluationCache(EVALUATION_CACHE_SIZE)
+evaluation_paths = {
+    "Digits": 0,
+    "Engine": 0,
+    "Evaluator Pool": 0,
+}  # How many get_num calls were handled by each evaluation path
+
+
+async def fetch_attachments(message: discord.Message):
+    """Concurrently download the image attachments of a message for re-uploading, within size limits. Attachments that
+    are too big (individually, or once the total budget runs out), or that fail to download are returned as skipped. If
+    any is too big, nothing is downloaded, as the original message is kept for it anyway (see resend_message).
+
+    :param message: Message to get the attachments of
+    :return: (files, skipped). Files to re-upload, and attachments that couldn't be
+    """
+    limit = message.guild.filesize_limit if message.guild else ATTACHMENT_TOTAL_BUDGET
+    file_cap = min(ATTACHMENT_FILE_CAP, limit)
+    budget = min(ATTACHMENT_TOTAL_BUDGET, limit)
+    to_upload, skipped = [], []
+    for attach in message.attachments:
+        if not attach.content_type or not attach.content_type.startswith("image/"):
+            continue
+        if attach.size > file_cap or attach.size > budget:
+            skipped.append(attach)
+            continue
+        budget -= attach.size
+        to_upload.append(attach)
+    if skipped:
+        return [], skipped
+
+    files = []
+    results = await asyncio.gather(
+        *(attach.to_file() for attach in to_upload), return_exceptions=True
+    )
+    for attach, result in zip(to_upload, results):
+        if isinstance(result, Exception):
+            skipped.append(attach)
+        else:
+            files.append(result)
+    return files, skipped
+
+
+async def evaluate_message(message: discord.Message):
+    """Get a number from a user input, potentially containing mathematical expressions, without sending anything.
 
     :param message: Message to get the input from
-    :param reply: Whether to reply to the user with details in select fail-evaluate circumstances
-    :return: Number if successful, None if unsuccessful
+    :return: (number, notices). Number is None if unsuccessful, notices is a list of kwargs for expression_reply
+        (excluding message), detailing select fail-evaluate circumstances to reply to the user with
     """
     # If it's just a digit, let's handle it without the evaluator
     simple_contents = message.content.strip().replace(",", "")
     if simple_contents.isdigit():
-        return int(simple_contents)
+        evaluation_paths["Digits"] += 1
+        return int(simple_contents), []
 
     # It might be an expression, let's extract the code if it's in a code block
     match = CODE_BLOCK_REGEX.match(message.content)
@@ -221,30 +464,36 @@ async def get_num(message: discord.Message, reply: bool = False):
     else:
         content = message.content
 
-    result = safe_eval(content).result()
+    key = content.strip()
+    result = evaluation_cache.get(key)
+    if result is None:
+        # Expressions the engine supports are evaluated right here, everything else goes through the evaluator pool
+        result = engine_eval(content)
+        if result is not None:
+            evaluation_paths["Engine"] += 1
+        else:
+            evaluation_paths["Evaluator Pool"] += 1
+            result = await evaluator.evaluate(content)
+        evaluation_cache.put(key, result)
+    notices = []
     if (
         result[0] is Exception
     ):  # If first element is an Exception, evaluation failed, there may be a fail_msg to reply
         _, fail_msg = result
-        if reply and fail_msg is not None:
-            await expression_reply(message, content, fail_msg)
-        return None
+        if fail_msg is not None:
+            notices.append({"exp": content, "content": fail_msg})
+        return None, notices
     else:  # Evaluation was successful if it's anything other than an exception
         eval_output, ws = result
 
     # Handle all warnings
-    if reply:
-        for w in ws:
-            if w.category in [
-                simpleeval.AssignmentAttempted,
-                simpleeval.MultipleExpressions,
-            ]:
-                msg = str(w.message).replace("\n", "\\n").replace("`", "[backtick]")
-                await expression_reply(
-                    message,
-                    content,
-                    f"`{msg}`",
-                )
+    for w in ws:
+        if w.category in [
+            simpleeval.AssignmentAttempted,
+            simpleeval.MultipleExpressions,
+        ]:
+            msg = str(w.message).replace("\n", "\\n").replace("`", "[backtick]")
+            notices.append({"exp": content, "content": f"`{msg}`"})
 
     if isinstance(eval_output, float):
         if eval_output.is_integer():  # Float type, but whole number
@@ -252,46 +501,140 @@ async def get_num(message: discord.Message, reply: bool = False):
                 eval_output
             )  # Convert to integer so it succeeds int check later
         else:  # Float type, not a whole number
-            if reply:
-                await expression_reply(
-                    message,
-                    content,
-                    f"= *`{eval_output}`*\n\nTo prevent unexpected behaviour, I do not automatically convert "
-                    "decimal numbers to whole numbers. You can do this yourself with:\n"
+            notices.append(
+                {
+                    "exp": content,
+                    "content": f"= *`{eval_output}`*\n\nTo prevent unexpected behaviour, I do not automatically "
+                    "convert decimal numbers to whole numbers. You can do this yourself with:\n"
                     "- `int(your content)`: Truncates (ignores all decimals)\n"
                     "- `floor(your content)`: Rounds down\n"
                     "- `ceil(your content)`: Rounds up\n"
                     "- `round(your content)`: Rounds (<= 0.5 down, > 0.5 up)\n"
                     "- `dividend//divisor`: Floor division, divides then rounds down (truncates)",
-                    delete_after=30,
-                )
-            return None
+                    "delete_after": 30,
+                }
+            )
+            return None, notices
 
     if isinstance(eval_output, int):
-        return eval_output
+        return eval_output, notices
 
-    return None
+    return None, notices
 
 
-class Counting(commands.Cog):
-    """Counting Plugin"""
+async def get_num(message: discord.Message, reply: bool = False):
+    """Get a number from a user input, potentially containing mathematical expressions.
 
-    def __init__(self, bot: commands.Bot):
-        self.bot = bot
-        self.channel = bot.get_channel(COUNTING_CHANNEL)
+    :param message: Message to get the input from
+    :param reply: Whether to reply to the user with details in select fail-evaluate circumstances
+    :return: Number if successful, None if unsuccessful
+    """
+    num, notices = await evaluate_message(message)
+    if reply:
+        for notice in notices:
+            await expression_reply(message, **notice)
+    return num
+
+
+class PendingMessage:
+    """Stand-in for a bot message that has been decided on under the lock, but not sent yet (see CountingState.enqueue).
+    Provides the discord.Message attributes that the counting logic relies on, and is swapped out for the real message
+    once it has been sent."""
+
+    def __init__(
+        self,
+        channel: discord.TextChannel,
+        author: discord.ClientUser,
+        content: str,
+        embed: discord.Embed = None,
+    ):
+        self.id = None  # Never matches edited/deleted messages
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.reactions = []
+        self.created_at = discord.utils.utcnow()
+
+
+class CountingState:
+    """Counting state for a single counting channel, each channel has its own lock so channels don't block each other.
+
+    The lock should only be held while deciding on and updating the count. All Discord I/O resulting from that decision
+    (reactions, replies, resends) should be queued with enqueue, which runs it in order, outside the lock.
+    """
+
+    def __init__(self, channel_id: int, settings: dict):
+        self.channel_id = channel_id
+        self.settings = (
+            settings  # Channel's entry in the config file, modified in-place
+        )
+        self.channel = None  # Resolved once the bot is ready
         self.last_number = None
         self.last_message = (
             None  # DO NOT RELY ON FOR CURRENT #, use self.last_number instead
         )
         self.lock = asyncio.Lock()  # To prevent dual-processing edge-cases
-        self.bot.loop.create_task(
-            self.async_init()
-        )  # Run async_init, which performs async setup tasks
+        self.outbox = (
+            deque()
+        )  # Discord I/O jobs (coroutine functions) waiting to run, in order
+        self.outbox_task = None
+        self.last_reaction = (
+            0  # Monotonic time of the last success reaction, for speed mode
+        )
+        self.chatter = (
+            []
+        )  # Non-number messages waiting to be resent together, for chatter coalescing
+        self.chatter_timer = None
+        self.reactions_saved = 0  # Success reactions skipped by speed mode
+
+    def should_react(self, number: int) -> bool:
+        """Check whether an accepted count should get a success reaction. Always true, unless the channel is in speed
+        mode, where only milestones, and at most one count per SPEED_MODE_WINDOW get one (reduces API calls during
+        counting events, so reactions don't lag behind the count).
+
+        :param number: Number that was accepted
+        :return: Whether to react
+        """
+        now = time.monotonic()
+        if (
+            not self.settings.get("speed_mode")
+            or number % SPEED_MODE_MILESTONE == 0
+            or now - self.last_reaction >= SPEED_MODE_WINDOW
+        ):
+            self.last_reaction = now
+            return True
+        self.reactions_saved += 1
+        return False
 
-    async def async_init(self):
-        """Perform asynchronous actions when the Cog initializes"""
-        async with self.lock:
-            await self.assert_last(only_history=True)
+    def enqueue(self, job):
+        """Queue a Discord I/O job to be run after all previously queued jobs for this channel.
+
+        :param job: Coroutine function (taking no arguments) to run
+        """
+        self.outbox.append(job)
+        if self.outbox_task is None or self.outbox_task.done():
+            self.outbox_task = asyncio.get_running_loop().create_task(self.run_outbox())
+
+    async def run_outbox(self):
+        """Run queued Discord I/O jobs in order, until there are none left."""
+        while self.outbox:
+            job = self.outbox.popleft()
+            try:
+                await job()
+            except (
+                discord.HTTPException
+            ):  # Message deleted, missing permissions, etc. Nothing we can do about it
+                pass
+            except (
+                Exception,
+            ):  # Don't let one broken job stop the rest from being sent
+                traceback.print_exc()
+
+    async def drain(self):
+        """Wait until all queued Discord I/O jobs have run."""
+        while self.outbox_task is not None and not self.outbox_task.done():
+            await asyncio.shield(self.outbox_task)
 
     def get_representation(self):
         """Get a representation of the last number, returning the number itself by default, but a code block
@@ -312,17 +655,610 @@ class Counting(commands.Cog):
                 content = self.last_message.content
             return f"\n{get_exp_code(content)}\n"
 
-    async def fail(self, title: str, message: discord.Message):
+
+class Leaderboard:
+    """Scores kept in descending order, so top-N and rank queries don't need to sort (or scan) every score."""
+
+    def __init__(self):
+        self.scores = {}  # ID -> score
+        self.ranking = []  # Sorted (-score, ID) pairs
+
+    def add(self, key: int, amount: int = 1):
+        """Add to the score of an ID, keeping the ranking sorted (binary search to find and insert)."""
+        score = self.scores.get(key, 0)
+        if score:
+            del self.ranking[bisect_left(self.ranking, (-score, key))]
+        score += amount
+        self.scores[key] = score
+        insort(self.ranking, (-score, key))
+
+    def top(self, n: int):
+        """Get the top n (ID, score) pairs."""
+        return [(key, -score) for score, key in self.ranking[:n]]
+
+    def rank(self, key: int):
+        """Get the rank (1-indexed) of an ID, None if it has no score."""
+        score = self.scores.get(key)
+        if not score:
+            return None
+        return bisect_left(self.ranking, (-score, key)) + 1
+
+
+class ChannelStats:
+    """In-memory aggregates of counting stats for a single counting channel."""
+
+    def __init__(self):
+        self.counts = Leaderboard()
+        self.fails = Leaderboard()
+        self.highest = 0
+        self.streak = 0  # Counts since the last fail
+
+
+class StatsStore:
+    """Counting stats, aggregated in memory (so queries never touch disk or channel history), and persisted to an SQLite
+    database in batches, off the event loop."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.channels = {}  # Channel ID -> ChannelStats
+        self.pending_users = (
+            {}
+        )  # (Channel ID, user ID) -> [counts, fails], not yet written to disk
+        self.pending_channels = (
+            set()
+        )  # Channel IDs with highest/streak not yet written to disk
+        self.lock = asyncio.Lock()  # Only one write at a time
+
+    def get(self, channel_id: int) -> ChannelStats:
+        """Get the stats of a channel."""
+        stats = self.channels.get(channel_id)
+        if stats is None:
+            stats = self.channels[channel_id] = ChannelStats()
+        return stats
+
+    def connect(self):
+        """Connect to the database, creating the tables if needed. Blocking, used from worker threads."""
+        db = sqlite3.connect(self.path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS user_stats (channel_id INTEGER, user_id INTEGER, counts INTEGER NOT NULL, "
+            "fails INTEGER NOT NULL, PRIMARY KEY (channel_id, user_id))"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS channel_stats (channel_id INTEGER PRIMARY KEY, highest INTEGER NOT NULL, "
+            "streak INTEGER NOT NULL)"
+        )
+        return db
+
+    def load(self):
+        """Load stats from the database into memory. Blocking, run via asyncio.to_thread."""
+        db = self.connect()
+        try:
+            for channel_id, user_id, counts, fails in db.execute(
+                "SELECT channel_id, user_id, counts, fails FROM user_stats"
+            ):
+                stats = self.get(channel_id)
+                if counts:
+                    stats.counts.add(user_id, counts)
+                if fails:
+                    stats.fails.add(user_id, fails)
+            for channel_id, highest, streak in db.execute(
+                "SELECT channel_id, highest, streak FROM channel_stats"
+            ):
+                stats = self.get(channel_id)
+                stats.highest = highest
+                stats.streak = streak
+        finally:
+            db.close()
+
+    def record_count(self, channel_id: int, user_id: int, number: int):
+        """Record an accepted count."""
+        stats = self.get(channel_id)
+        stats.counts.add(user_id)
+        stats.highest = max(stats.highest, number)
+        stats.streak += 1
+        self.pending_users.setdefault((channel_id, user_id), [0, 0])[0] += 1
+        self.pending_channels.add(channel_id)
+
+    def record_fail(self, channel_id: int, user_id: int):
+        """Record a ruined count."""
+        stats = self.get(channel_id)
+        stats.fails.add(user_id)
+        stats.streak = 0
+        self.pending_users.setdefault((channel_id, user_id), [0, 0])[1] += 1
+        self.pending_channels.add(channel_id)
+
+    def write(self, users: list, channels: list):
+        """Write stat changes to the database. Blocking, run via asyncio.to_thread.
+
+        :param users: (channel ID, user ID, counts delta, fails delta) tuples
+        :param channels: (channel ID, highest, streak) tuples
+        """
+        db = self.connect()
+        try:
+            with db:  # Single transaction
+                db.executemany(
+                    "INSERT INTO user_stats VALUES (?, ?, ?, ?) ON CONFLICT (channel_id, user_id) DO UPDATE SET "
+                    "counts = counts + excluded.counts, fails = fails + excluded.fails",
+                    users,
+                )
+                db.executemany(
+                    "INSERT OR REPLACE INTO channel_stats VALUES (?, ?, ?)", channels
+                )
+        finally:
+            db.close()
+
+    async def flush(self):
+        """Write all pending stat changes to the database, off the event loop. If the write fails, the changes are kept
+        pending (merged with any made since), to be written next time. Cancelling doesn't stop a write that started, so
+        the changes aren't kept then, as the upsert adds them and writing them again would count them twice.
+        """
+        async with self.lock:
+            if not self.pending_users and not self.pending_channels:
+                return
+            users = [
+                (channel_id, user_id, counts, fails)
+                for (channel_id, user_id), (counts, fails) in self.pending_users.items()
+            ]
+            channels = [
+                (
+                    channel_id,
+                    self.channels[channel_id].highest,
+                    self.channels[channel_id].streak,
+                )
+                for channel_id in self.pending_channels
+            ]
+            self.pending_users = {}
+            self.pending_channels = set()
+            try:
+                await asyncio.to_thread(self.write, users, channels)
+            except Exception:
+                for channel_id, user_id, counts, fails in users:
+                    pending = self.pending_users.setdefault(
+                        (channel_id, user_id), [0, 0]
+                    )
+                    pending[0] += counts
+                    pending[1] += fails
+                self.pending_channels.update(
+                    channel_id for channel_id, _, _ in channels
+                )
+                raise
+
+
+class DeletableIndex:
+    """Bounded index of user-deletable bot messages (with a 🗑️ reaction) to the users allowed to delete them, evicting the
+    least recently used messages first. Persisted to disk in batches, off the event loop.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.owners = (
+            OrderedDict()
+        )  # Message ID -> owner user IDs, one per embed (in order), least recently used first
+        self.dirty = False
+
+    def load(self):
+        """Load the index from disk. Blocking, run via asyncio.to_thread."""
+        data = read_json(self.path, {})
+        self.owners = OrderedDict(
+            (int(message_id), owners) for message_id, owners in data.items()
+        )
+        while len(self.owners) > self.size:
+            self.owners.popitem(last=False)
+
+    def get(self, message_id: int):
+        """Get the owners of a message, None if it isn't deletable."""
+        owners = self.owners.get(message_id)
+        if owners is not None:
+            self.owners.move_to_end(message_id)
+        return owners
+
+    def set(self, message_id: int, owners: list):
+        """Set the owners of a message, making it deletable by them."""
+        self.owners[message_id] = owners
+        self.owners.move_to_end(message_id)
+        while len(self.owners) > self.size:
+            self.owners.popitem(last=False)
+        self.dirty = True
+
+    def remove(self, message_id: int):
+        """Remove a message from the index, if it's in it."""
+        if self.owners.pop(message_id, None) is not None:
+            self.dirty = True
+
+    async def flush(self):
+        """Write the index to disk if it changed, off the event loop."""
+        if not self.dirty:
+            return
+        self.dirty = False
+        # JSON objects keep their order, so the LRU order survives restarts
+        data = {str(message_id): owners for message_id, owners in self.owners.items()}
+        try:
+            await asyncio.to_thread(write_json_atomic, self.path, data)
+        except Exception:  # Try again next time
+            self.dirty = True
+            raise
+
+
+class CountAudit:
+    """Replays counting history through the same rules counting_on_message enforces, writing a compact report of the
+    count timeline, fails, and anomalies (where what happened differs from what the rules say should have happened).
+    """
+
+    def __init__(self, bot_id: int, report):
+        self.bot_id = bot_id
+        self.report = report  # Text file to write report lines to
+        self.number = (
+            None  # Count according to the replay, None until a starting point is found
+        )
+        self.last_author = None
+        self.last_created_at = None
+        self.messages = 0
+        self.counts = 0
+        self.fails = 0
+        self.pending_fails = (
+            0  # Fails detected by the replay, whose fail message hasn't been seen yet
+        )
+        self.anomalies = 0
+        self.highest = 0
+
+    def write(self, message: discord.Message, event: str, details: str = ""):
+        """Write a line to the report."""
+        self.report.write(
+            f"{message.created_at:%Y-%m-%d %H:%M:%S} {message.id} {event} {details}\n"
+        )
+
+    def anomaly(self, message: discord.Message, details: str):
+        """Write an anomaly line to the report."""
+        self.anomalies += 1
+        self.write(message, "ANOMALY", details)
+
+    @staticmethod
+    def reacted(message: discord.Message, emoji: str) -> bool:
+        """Check whether we reacted to a message with an emoji."""
+        return any(i.me and i.emoji == emoji for i in message.reactions)
+
+    def is_candidate(self, message: discord.Message) -> bool:
+        """Check whether a message could be a count, and needs to be evaluated (same filters as assert_last)."""
+        if message.author.bot:
+            return False
+        return len(message.content) > 0 and not message.content.startswith("//")
+
+    def replay(self, message: discord.Message, num):
+        """Replay a single message.
+
+        :param message: Message to replay, in chronological order
+        :param num: Result of get_num for the message, None if it isn't a number (or wasn't evaluated)
+        """
+        self.messages += 1
+        if message.author.bot:
+            if message.author.id != self.bot_id or not message.content.isdigit():
+                return  # Not a count message from us (resends, help, other bots)
+            # Our digit messages restate the count (fails, resets, edit/delete detection, overrides)
+            stated = int(message.content)
+            embed = message.embeds[0] if message.embeds else None
+            title = (embed.title if embed else None) or ""
+            description = (embed.description if embed else None) or ""
+            if self.number is None:
+                self.write(message, "START", f"{stated:,d}")
+            elif "ruined the count" in description:  # Fail message
+                if (
+                    self.pending_fails > 0
+                ):  # Fail the replay already detected (may be sent after later counts)
+                    self.pending_fails -= 1
+                    return
+                self.write(
+                    message, "RESET", f"undetected fail, count was {self.number:,d}"
+                )
+            elif "tried editing" in description or "tried deleting" in description:
+                # Doesn't change the count, and whoever edited/deleted still can't count next (see counting_on_message)
+                if stated != self.number:
+                    self.anomaly(
+                        message,
+                        f"count restated as {stated:,d}, replay was at {self.number:,d}",
+                    )
+                return
+            elif title == "Count Overridden!":
+                self.write(
+                    message, "OVERRIDE", f"{stated:,d}, count was {self.number:,d}"
+                )
+            elif stated != self.number:
+                self.write(message, "RESET", f"{stated:,d}, count was {self.number:,d}")
+            self.number = stated
+            self.last_author = message.author.id
+            self.last_created_at = message.created_at
+            return
+
+        if num is None:
+            return
+        if self.number is None:  # First count found, use it as the starting point
+            self.write(message, "START", f"{num:,d} by {message.author.id}")
+            self.accept(message, num)
+            return
+
+        if num == self.number + 1 and message.author.id != self.last_author:
+            if self.reacted(message, "❌"):
+                self.anomaly(
+                    message,
+                    f"valid count {num:,d} by {message.author.id} was marked as a fail",
+                )
+            self.accept(message, num)
+        elif (
+            num == self.number
+            and message.author.id != self.last_author
+            and (message.created_at - self.last_created_at).total_seconds()
+            <= DUPLICATE_GRACE
+        ):
+            self.write(message, "GRACE", f"{num:,d} by {message.author.id}")
+        else:
+            self.fails += 1
+            self.pending_fails += 1
+            self.write(
+                message,
+                "FAIL",
+                f"{num:,d} by {message.author.id}, count was {self.number:,d}",
+            )
+            if not self.reacted(message, "❌"):
+                self.anomaly(
+                    message, f"fail by {message.author.id} was not marked as a fail"
+                )
+            self.number = 0
+            self.last_author = None
+
+    def accept(self, message: discord.Message, num: int):
+        """Accept a count in the replay."""
+        self.counts += 1
+        self.number = num
+        self.highest = max(self.highest, num)
+        self.last_author = message.author.id
+        self.last_created_at = message.created_at
+
+    def summary(self) -> str:
+        """Get a summary of the audit so far."""
+        current = f"{self.number:,d}" if self.number is not None else "N/A"
+        return (
+            f"Messages: **{self.messages:,d}** | Counts: **{self.counts:,d}** | Fails: **{self.fails:,d}** | "
+            f"Anomalies: **{self.anomalies:,d}** | Highest: **{self.highest:,d}** | Current: **{current}**"
+        )
+
+
+class Counting(commands.Cog):
+    """Counting Plugin"""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.config = {}
+        self.states = {}  # Channel ID -> CountingState
+        self.checkpoint_dirty = False
+        self.checkpoint_task = None
+        self.stats = StatsStore(STATS_FILE)
+        self.stats_task = None
+        self.deletable = DeletableIndex(DELETABLE_FILE, DELETABLE_INDEX_SIZE)
+        self.load_config()
+        self.bot.loop.create_task(
+            self.async_init()
+        )  # Run async_init, which performs async setup tasks
+
+    async def async_init(self):
+        """Perform asynchronous actions when the Cog initializes"""
+        evaluator.start()
+        await asyncio.to_thread(self.stats.load)
+        await asyncio.to_thread(self.deletable.load)
+        self.stats_task = self.bot.loop.create_task(self.flush_stats())
+        await self.bot.wait_until_ready()
+        checkpoints = await asyncio.to_thread(read_json, CHECKPOINT_FILE, {})
+        await asyncio.gather(
+            *(self.init_state(state, checkpoints) for state in self.states.values())
+        )
+
+    async def init_state(self, state: CountingState, checkpoints: dict):
+        """Resolve the channel of a counting state, and recover its count.
+
+        :param state: State to initialize
+        :param checkpoints: Checkpoint file data
+        """
+        state.channel = self.bot.get_channel(state.channel_id)
+        if state.channel is None:  # Channel no longer exists, or we can't see it
+            return
+        async with state.lock:
+            if not await self.restore_checkpoint(state, checkpoints):
+                await self.assert_last(state, only_history=True)
+
+    async def cog_unload(self):
+        """Stop the evaluator pool, and save any unsaved stats and deletable messages when the Cog is unloaded"""
+        evaluator.stop()
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+            # Let a flush in progress finish unwinding, so the last flush only writes what it didn't
+            await asyncio.wait([self.stats_task])
+        await self.stats.flush()
+        await self.deletable.flush()
+
+    async def flush_stats(self):
+        """Periodically write counting stats and the deletable message index to disk, batching the changes in between."""
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            try:
+                await self.stats.flush()
+                await self.deletable.flush()
+            except (
+                Exception,
+            ):  # Keep trying, changes made since will still be written next time
+                traceback.print_exc()
+
+    def load_config(self):
+        """Load the counting channels from the config file, creating it with the default channel if it doesn't exist"""
+        self.config = read_json(CONFIG_FILE)
+        if self.config is None:
+            self.config = {"channels": {str(COUNTING_CHANNEL): {}}}
+            write_json_atomic(CONFIG_FILE, self.config)
+        self.states = {
+            int(channel_id): CountingState(int(channel_id), settings)
+            for channel_id, settings in self.config["channels"].items()
+        }
+
+    def get_state(self, channel_id: int):
+        """Get the counting state for a channel, None if it isn't a counting channel"""
+        state = self.states.get(channel_id)
+        if (
+            state is None or state.channel is None
+        ):  # Not a counting channel, or not initialized yet
+            return None
+        return state
+
+    def get_command_state(
+        self, ctx: commands.Context, channel: discord.TextChannel = None
+    ):
+        """Get the counting state for a command's optional channel argument, defaulting to the current channel if it's a
+        counting channel, or the main counting channel otherwise.
+
+        :param ctx: Command context
+        :param channel: Channel provided to the command, if any
+        :return: Counting state, None if the channel isn't a counting channel
+        """
+        if channel is None:
+            channel = (
+                ctx.channel
+                if ctx.channel.id in self.states
+                else self.bot.get_channel(COUNTING_CHANNEL)
+            )
+        return self.get_state(channel.id) if channel else None
+
+    def save_checkpoint(self):
+        """Schedule the current counts to be written to the checkpoint file. Writes happen off the event loop, and
+        multiple saves while a write is in progress are coalesced into a single write of the latest counts.
+        """
+        self.checkpoint_dirty = True
+        if self.checkpoint_task is None or self.checkpoint_task.done():
+            self.checkpoint_task = self.bot.loop.create_task(self.write_checkpoint())
+
+    async def write_checkpoint(self):
+        """Write the checkpoint file until there are no unsaved changes left, see save_checkpoint."""
+        while self.checkpoint_dirty:
+            self.checkpoint_dirty = False
+            data = {
+                str(channel_id): {
+                    "number": state.last_number,
+                    "message_id": state.last_message.id,
+                    "author_id": state.last_message.author.id,
+                    "timestamp": state.last_message.created_at.timestamp(),
+                }
+                for channel_id, state in self.states.items()
+                if state.last_number is not None
+                and state.last_message is not None
+                and state.last_message.id is not None  # Not a PendingMessage
+            }
+            await asyncio.to_thread(write_json_atomic, CHECKPOINT_FILE, data)
+
+    async def restore_checkpoint(self, state: CountingState, checkpoints: dict) -> bool:
+        """Restore state.last_number and state.last_message from the checkpoint file. Only the messages sent after the
+        checkpointed message are searched for a newer count, the checkpoint is used if there are none.
+
+        :param state: State to restore
+        :param checkpoints: Checkpoint file data
+        :return: Whether the restore was successful, False if the checkpoint is missing or invalid
+        """
+        checkpoint = checkpoints.get(str(state.channel_id))
+        if not checkpoint:
+            return False
+        try:
+            message = await state.channel.fetch_message(checkpoint["message_id"])
+        except (
+            KeyError,
+            discord.HTTPException,
+        ):  # Includes NotFound, if the message was deleted
+            return False
+        if message.author.id != checkpoint.get(
+            "author_id"
+        ):  # Shouldn't happen, but don't trust it if it does
+            return False
+        # Counts made while the bot was offline, or lost with a checkpoint write on a crash, supersede it
+        found = await self.find_count(
+            state.channel.history(after=message, limit=None, oldest_first=False)
+        )
+        if found is not None:
+            self.recover_count(state, *found)
+            return True
+        state.last_number = checkpoint["number"]
+        state.last_message = message
+        return True
+
+    async def find_count(self, messages, default_message: discord.Message = None):
+        """Find the most recent count in some messages: messages from users, or our own plain digit messages.
+
+        :param messages: Async iterator of messages, most recent first
+        :param default_message: Message to skip
+        :return: (number, message) if a count was found, None otherwise
+        """
+        async for message in messages:
+            if (
+                default_message and message.id == default_message.id
+            ):  # Do not include message provided as default
+                continue
+            if (
+                message.author.bot and message.author.id != self.bot.user.id
+            ):  # Bot that isn't us
+                continue
+            if len(message.content) == 0:  # Empty message, don't bother
+                continue
+            if (
+                message.author.bot and not message.content.isdigit()
+            ):  # All of our messages with #s are plain digits
+                continue
+            num = await get_num(message)
+            if num is not None:
+                return num, message
+        return None
+
+    def recover_count(self, state: CountingState, num: int, message: discord.Message):
+        """Set state.last_number and state.last_message to a count found in the channel's history, and mark it.
+
+        :param state: State of the channel the count was found in
+        :param num: Number of the count
+        :param message: Message of the count
+        """
+        state.last_number = num
+        state.last_message = message
+        self.save_checkpoint()
+        if not any([i.me and i.emoji == "✅" for i in message.reactions]):
+            state.enqueue(lambda: message.add_reaction("✅"))
+
+    def send_count_message(
+        self, state: CountingState, content: str, embed: discord.Embed = None
+    ):
+        """Set state.last_message to a bot message, which is queued to be sent rather than sent immediately. Until it is
+        sent, a PendingMessage stands in for it.
+
+        :param state: State of the channel to send the message in
+        :param content: Message content, should be a plain digit if it's a count (allows for count recovery)
+        :param embed: Message embed
+        """
+        pending = PendingMessage(state.channel, self.bot.user, content, embed)
+        state.last_message = pending
+
+        async def job():
+            message = await state.channel.send(content=content, embed=embed)
+            if (
+                state.last_message is pending
+            ):  # Nobody has counted since, swap it for the real message
+                state.last_message = message
+                self.save_checkpoint()
+
+        state.enqueue(job)
+
+    def fail(self, state: CountingState, title: str, message: discord.Message):
         """Method to send a count-failed message with a customizable title.
 
+        :param state: State of the channel the count-fail happened in
         :param title: Title to use for the count-failed embed
         :param message: Message that resulted in the count-fail
         """
-        await message.add_reaction("❌")
+        self.stats.record_fail(state.channel_id, message.author.id)
+        state.enqueue(lambda: message.add_reaction("❌"))
 
         embed = discord.Embed(
             title=title,
-            description=f"{message.author.mention} ruined the count at **{self.last_number:,d}**. Next number is **1**.\n\n"
+            description=f"{message.author.mention} ruined the count at **{state.last_number:,d}**. Next number is **1**.\n\n"
             "*If this detection appears incorrect, please report it to the bot development team.*",
             colour=discord.Colour.red(),
         )
@@ -331,56 +1267,43 @@ class Counting(commands.Cog):
         )
         set_embed_author_footer(embed, message.author)
 
-        self.last_number = 0
-        self.last_message = await message.channel.send(
-            content="0", embed=embed
+        state.last_number = 0
+        self.send_count_message(
+            state, "0", embed
         )  # "0" content allows for count recovery
-        return
 
     async def assert_last(
-        self, default_message: discord.Message = None, only_history: bool = False
+        self,
+        state: CountingState,
+        default_message: discord.Message = None,
+        only_history: bool = False,
     ):
         """
-        Ensure that self.last_number and self.last_message exist. If they don't exist, the following will be done in order:
+        Ensure that state.last_number and state.last_message exist. If they don't exist, the following will be done in order:
 
         1. Search previous 100 messages for counts
         2. If number in optionally provided message, assume that number is valid, and set last_number to be 1 before it
         3. Reset count to 0
 
-        If this method is run, it can be guaranteed that self.last_number and self.last_message will exist in some form
+        If this method is run, it can be guaranteed that state.last_number and state.last_message will exist in some form
         (except using only_history).
 
+        :param state: State of the channel to ensure the existence of a count in
         :param default_message: Message to attempt to default to if search fails. Will not be included in history search.
-        :param only_history: Whether to only attempt a history recover, if this is True, self.last_number and self.last_message cannot be guaranteed to exist.
+        :param only_history: Whether to only attempt a history recover, if this is True, state.last_number and state.last_message cannot be guaranteed to exist.
         """
         if (
-            self.last_number is not None and self.last_message is not None
+            state.last_number is not None and state.last_message is not None
         ):  # If they already exist, return
             return
 
         # Search last 100 messages (in order of most recent -> oldest) for a valid count
-        async for message in self.channel.history(limit=100, oldest_first=False):
-            if (
-                default_message and message.id == default_message.id
-            ):  # Do not include message provided as default
-                continue
-            if (
-                message.author.bot and message.author.id != self.bot.user.id
-            ):  # Bot that isn't us
-                continue
-            if len(message.content) == 0:  # Empty message, don't bother
-                continue
-            if (
-                message.author.bot and not message.content.isdigit()
-            ):  # All of our messages with #s are plain digits
-                continue
-            num = await get_num(message)
-            if num is not None:
-                self.last_number = num
-                self.last_message = message
-                if not any([i.me and i.emoji == "✅" for i in message.reactions]):
-                    await message.add_reaction("✅")
-                return
+        found = await self.find_count(
+            state.channel.history(limit=100, oldest_first=False), default_message
+        )
+        if found is not None:
+            self.recover_count(state, *found)
+            return
 
         if (
             only_history
@@ -390,17 +1313,18 @@ class Counting(commands.Cog):
         if default_message:  # Check the default_message, if provided, for a valid count
             num = await get_num(default_message)
             if num is not None:
-                self.last_number = num - 1
-                self.last_message = await self.channel.send(
-                    content="*Count Recovered - Ignore This Message*"
+                state.last_number = num - 1
+                self.send_count_message(
+                    state, "*Count Recovered - Ignore This Message*"
                 )  # So double-count doesn't kick in
                 return
 
         # All recovery steps failed, reset count to 0
-        self.last_number = 0
-        self.last_message = await self.channel.send(
-            content="0",
-            embed=set_embed_footer(
+        state.last_number = 0
+        self.send_count_message(
+            state,
+            "0",
+            set_embed_footer(
                 discord.Embed(
                     title="Count Reset to 0",
                     description="I was unable to find any previous counting data, through any recovery method. As a result, "
@@ -418,7 +1342,8 @@ class Counting(commands.Cog):
             not message.author or not message.author.guild or message.author.bot
         ):  # Irrelevant
             return
-        if message.channel.id != COUNTING_CHANNEL:  # Not the counting channel
+        state = self.get_state(message.channel.id)
+        if state is None:  # Not a counting channel
             return
 
         # Special Messages (Keyword)
@@ -436,71 +1361,83 @@ class Counting(commands.Cog):
                     message.author,
                 )
             )
+            self.deletable.set(msg.id, [message.author.id])
             await message.delete()
             return await msg.add_reaction("🗑️")
 
-        async with self.lock:  # Utilize async lock to prevent parallel message processing edge cases
+        async with state.lock:  # Utilize async lock to prevent parallel message processing edge cases
             await self.assert_last(
-                message
-            )  # Ensure self.last_number and self.last_message exists
-            current_number = await get_num(message, reply=True)
+                state, message
+            )  # Ensure state.last_number and state.last_message exists
+            current_number, notices = await evaluate_message(message)
+            for notice in notices:
+                state.enqueue(lambda notice=notice: expression_reply(message, **notice))
             if current_number is not None:  # Is a number
-                expected_number = self.last_number + 1
+                expected_number = state.last_number + 1
 
                 if current_number != expected_number:  # They can't count :(
                     # Grace period for when people send the same number at the same time
                     if (
-                        current_number == self.last_number
-                        and message.author.id != self.last_message.author.id
+                        current_number == state.last_number
+                        and message.author.id != state.last_message.author.id
                         and (
-                            message.created_at - self.last_message.created_at
+                            message.created_at - state.last_message.created_at
                         ).total_seconds()
                         <= DUPLICATE_GRACE
                     ):
-                        await message.add_reaction("❌")
-                        return await message.reply(
-                            embed=set_embed_footer(
-                                discord.Embed(
-                                    title="That doesn't look right, but I'll give you a chance...",
-                                    description=f"{message.author.mention} sent a duplicate number, but within the grace period. "
-                                    f"The count is still at {self.get_representation()} "
-                                    f"(by {self.last_message.author.mention}).",
-                                    colour=discord.Colour.yellow(),
-                                )
+                        embed = set_embed_footer(
+                            discord.Embed(
+                                title="That doesn't look right, but I'll give you a chance...",
+                                description=f"{message.author.mention} sent a duplicate number, but within the grace period. "
+                                f"The count is still at {state.get_representation()} "
+                                f"(by {state.last_message.author.mention}).",
+                                colour=discord.Colour.yellow(),
                             )
                         )
+                        state.enqueue(lambda: message.add_reaction("❌"))
+                        return state.enqueue(lambda: message.reply(embed=embed))
 
-                    return await self.fail(
-                        "That doesn't look right! Better luck next time :)", message
+                    return self.fail(
+                        state,
+                        "That doesn't look right! Better luck next time :)",
+                        message,
                     )
                 elif (
-                    message.author.id == self.last_message.author.id
+                    message.author.id == state.last_message.author.id
                 ):  # They're trying to count by themselves!
-                    return await self.fail("You can't count twice in a row!", message)
+                    return self.fail(state, "You can't count twice in a row!", message)
                 elif (
-                    self.last_message.author.id == self.bot.user.id
-                    and len(self.last_message.embeds) > 0
+                    state.last_message.author.id == self.bot.user.id
+                    and len(state.last_message.embeds) > 0
                 ):  # Self-count, but they're trying to avoid detection
-                    embed = self.last_message.embeds[0]
+                    embed = state.last_message.embeds[0]
                     if (
                         "editing" in embed.description
                         or "deleting" in embed.description
                     ) and str(
                         message.author.id
                     ) in embed.author.name:  # Not a edit/delete message resulting from them
-                        await message.reply(
-                            content="Don't try to edit or delete your messages to get around detections please.\n"
-                            "If you're seeing this by pure coincidence, don't worry about it.",
-                            delete_after=10,
+                        state.enqueue(
+                            lambda: message.reply(
+                                content="Don't try to edit or delete your messages to get around detections please.\n"
+                                "If you're seeing this by pure coincidence, don't worry about it.",
+                                delete_after=10,
+                            )
                         )
-                        return await self.fail(
-                            "You can't count twice in a row!", message
+                        return self.fail(
+                            state, "You can't count twice in a row!", message
                         )
 
                 # They can count! - make sure any previous failing checks end with a return, or this code will run on a fail
-                self.last_number = current_number
-                self.last_message = message
-                return await message.add_reaction("✅")
+                state.last_number = current_number
+                state.last_message = message
+                self.save_checkpoint()
+                self.stats.record_count(
+                    state.channel_id, message.author.id, current_number
+                )
+                if state.should_react(current_number):
+                    state.enqueue(lambda: message.add_reaction("✅"))
+                return
             else:  # Not a number
                 # We're allowing bot developers to explicitly specify that their message should be ignored, for
                 #  circumstances where message resend is not ideal (e.g. when the feature is broken, or for important
@@ -510,140 +1447,621 @@ class Counting(commands.Cog):
                 ]:
                     return
 
+                # Plain text chatter can be resent together with other chatter, to save API calls. Attachments and
+                #  replies are always resent on their own, as they can't be merged cleanly
+                if (
+                    state.settings.get("coalesce")
+                    and not message.attachments
+                    and not message.reference
+                ):
+                    return self.add_chatter(state, message)
+
                 # We are resending the message as our own embed to allow for the restatement of the number (so it doesn't get lost)
                 embed = discord.Embed(
                     description=message.content, colour=discord.Colour.light_gray()
                 )
                 embed.add_field(
                     name="​",  # Zero-width space for an empty field name (using field as footer doesn't allow MD formatting)
-                    value=f"*The count is currently at:* {self.get_representation()} (*by {self.last_message.author.mention}*)",
+                    value=f"*The count is currently at:* {state.get_representation()} (*by {state.last_message.author.mention}*)",
                 )
                 set_embed_author_footer(embed, message.author)
-                files = []
-                if len(message.attachments) > 0:
-                    for attach in message.attachments:
-                        if (
-                            not attach.content_type
-                            or not attach.content_type.startswith("image/")
-                        ):
-                            continue
-                        files.append(await attach.to_file())
-                await message.delete()
-                msg = await message.channel.send(
-                    content=f"*Message by `{message.author.display_name.replace('`', '[backtick]')}`, "
-                    f"<t:{int(message.created_at.timestamp())}:R>*",
-                    embed=embed,
-                    reference=message.reference,
-                    mention_author=False,
-                    files=files,
+                attachments = (
+                    asyncio.create_task(fetch_attachments(message))
+                    if message.attachments
+                    else None
+                )  # Start downloading now, rather than when the resend's turn in the outbox comes
+                return state.enqueue(
+                    lambda: self.resend_message(message, embed, attachments)
                 )
-                return await msg.add_reaction(
-                    "🗑️"
-                )  # Make message user-deletable (via react)
 
-    @commands.Cog.listener("on_message_edit")
-    async def counting_on_message_edit(
-        self, before: discord.Message, after: discord.Message
+    async def resend_message(
+        self,
+        message: discord.Message,
+        embed: discord.Embed,
+        attachments: asyncio.Task = None,
     ):
-        """on_message_edit event handler to allow for handling of counting message edits"""
+        """Resend a non-number message as our own embed, deleting the original. If some of its attachments couldn't be
+        re-uploaded, the original is kept and linked for all of them instead, as uploading the rest again would only
+        duplicate them (attachments of deleted messages are removed by Discord).
+
+        :param message: Message to resend
+        :param embed: Embed to resend the message as, restating the count
+        :param attachments: Task running fetch_attachments for the message, if it has attachments
+        """
+        files, skipped = [], []
+        if attachments is not None:
+            files, skipped = await attachments
+        if (
+            skipped
+        ):  # Point to the original for its attachments instead, as many as fit in a field
+            for file in files:
+                file.close()
+            files = []
+            links = ""
+            for attach in message.attachments:
+                link = f"[{attach.filename}]({message.jump_url})\n"
+                if len(links) + len(link) > 1024:
+                    break
+                links += link
+            embed.add_field(
+                name="Attachments (in the original message)", value=links, inline=False
+            )
+        else:
+            await message.delete()
+        msg = await message.channel.send(
+            content=f"*Message by `{message.author.display_name.replace('`', '[backtick]')}`, "
+            f"<t:{int(message.created_at.timestamp())}:R>*",
+            embed=embed,
+            reference=message.reference,
+            mention_author=False,
+            files=files,
+        )
+        self.deletable.set(msg.id, [message.author.id])
+        await msg.add_reaction("🗑️")  # Make message user-deletable (via react)
+
+    def add_chatter(self, state: CountingState, message: discord.Message):
+        """Add a non-number message to the channel's chatter, to be resent together with any other chatter received
+        within CHATTER_COALESCE_WINDOW seconds.
+
+        :param state: State of the channel the message was sent in
+        :param message: Message to resend
+        """
+        state.chatter.append(message)
+        if len(state.chatter) >= CHATTER_COALESCE_MAX:
+            self.flush_chatter(state)
+        elif state.chatter_timer is None or state.chatter_timer.done():
+            state.chatter_timer = asyncio.get_running_loop().create_task(
+                self.chatter_timer(state)
+            )
+
+    async def chatter_timer(self, state: CountingState):
+        """Flush the channel's chatter once the coalescing window is over."""
+        await asyncio.sleep(CHATTER_COALESCE_WINDOW)
+        state.chatter_timer = None
+        self.flush_chatter(state)
+
+    def flush_chatter(self, state: CountingState):
+        """Queue the channel's chatter to be resent as one message, restating the count once. Consecutive messages by the
+        same author share an embed, so each author can still delete their own messages (see counting_on_reaction_add).
+        Chatter too long for a single message (see EMBEDS_TOTAL_LIMIT) is split over as many as needed.
+
+        :param state: State of the channel to flush the chatter of
+        """
+        chatter, state.chatter = state.chatter, []
         if (
-            before.channel.id != COUNTING_CHANNEL
-        ):  # Check if we're in counting channel first, to prevent excessive locks
+            state.chatter_timer is not None
+            and state.chatter_timer is not asyncio.current_task()
+        ):
+            state.chatter_timer.cancel()
+            state.chatter_timer = None
+        if not chatter:
             return
-        # Messages get detected as "edited" and trigger this even, even if they aren't edited for some reason.
-        # This is a temporary fix to prevent this issue from affecting the bot's own messages, as the reset message
-        # being deleted and resent is causing a lot of confusion.
-        # TODO: Fix underlying issue and remove temporary fix
-        if before.author.id == self.bot.user.id:
+
+        groups = (
+            []
+        )  # [embed, owner, messages], consecutive messages by the same author share an embed
+        for message in chatter:
+            if groups and groups[-1][1] == message.author.id:
+                embed = groups[-1][0]
+                description = f"{embed.description}\n{message.content}"
+                if len(description) <= EMBED_DESCRIPTION_LIMIT:
+                    embed.description = description
+                    groups[-1][2].append(message)
+                    continue
+            embed = set_embed_author_footer(
+                discord.Embed(
+                    description=message.content, colour=discord.Colour.light_gray()
+                ),
+                message.author,
+            )
+            groups.append([embed, message.author.id, [message]])
+
+        batches = []  # Groups resent together, as many as fit in a single message
+        length = 0
+        for group in groups:
+            if not batches or length + len(group[0]) > EMBEDS_TOTAL_LIMIT:
+                batches.append([])
+                length = 0
+            batches[-1].append(group)
+            length += len(group[0])
+
+        for batch in batches:
+            messages = [
+                message for _, _, group_messages in batch for message in group_messages
+            ]
+            authors = ", ".join(
+                dict.fromkeys(  # Unique, in order
+                    f"`{message.author.display_name.replace('`', '[backtick]')}`"
+                    for message in messages
+                )
+            )
+            header = f"*Messages by {authors}, <t:{int(messages[0].created_at.timestamp())}:R>*\n"
+            footer = f" (*by {state.last_message.author.mention}*)"
+            content = f"{header}*The count is currently at:* {state.get_representation()}{footer}"
+            if (
+                len(content) > CONTENT_LIMIT
+            ):  # Long expression, restate the plain number instead
+                content = f"{header}*The count is currently at:* **`{state.last_number:,d}`**{footer}"
+            state.enqueue(
+                functools.partial(
+                    self.resend_chatter,
+                    state.channel,
+                    messages,
+                    [embed for embed, _, _ in batch],
+                    [owner for _, owner, _ in batch],
+                    content,
+                )
+            )
+
+    async def resend_chatter(
+        self,
+        channel: discord.TextChannel,
+        chatter: list,
+        embeds: list,
+        owners: list,
+        content: str,
+    ):
+        """Resend multiple non-number messages as a single message, deleting the originals once it has been sent (so
+        they're kept if sending fails).
+
+        :param channel: Channel to resend the messages in
+        :param chatter: Messages to resend
+        :param embeds: Embeds to resend the messages as
+        :param owners: ID of the author of each embed
+        :param content: Message content, restating the count
+        """
+        msg = await channel.send(
+            content=content,
+            embeds=embeds,
+            allowed_mentions=discord.AllowedMentions.none(),  # Count restatement is in the content, don't ping
+        )
+        self.deletable.set(msg.id, owners)
+        if len(chatter) > 1:
+            await channel.delete_messages(chatter)  # Single API call
+        else:
+            await chatter[0].delete()
+        await msg.add_reaction("🗑️")  # Make message user-deletable (via react)
+
+    def is_live_count(self, channel_id: int, message_id: int):
+        """Check whether a message is the current count, without taking the lock (so edits and deletes of any other
+        message don't cause lock contention). Must be re-checked once the lock is acquired.
+
+        :param channel_id: ID of the channel the message is in
+        :param message_id: ID of the message
+        :return: Counting state of the channel if the message is its current count, otherwise None
+        """
+        state = self.get_state(channel_id)
+        if (
+            state is None
+            or state.last_message is None
+            or state.last_message.id != message_id
+        ):
+            return None
+        return state
+
+    @commands.Cog.listener("on_raw_message_edit")
+    async def counting_on_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """on_raw_message_edit event handler to allow for handling of counting message edits (including uncached ones)"""
+        state = self.is_live_count(payload.channel_id, payload.message_id)
+        if state is None:
+            return
+        # Embed unfurls are also sent as message updates, but (unlike actual edits) don't set edited_timestamp
+        if not payload.data.get("edited_timestamp"):
             return
 
-        async with self.lock:  # Utilize async lock to prevent parallel message processing edge cases
-            if not self.last_message or before.id != self.last_message.id:
+        async with state.lock:  # Utilize async lock to prevent parallel message processing edge cases
+            if not state.last_message or payload.message_id != state.last_message.id:
                 return
+            message = state.last_message
 
             # Do not remove the "editing" portion of the embed, other segments of code look for that as a keyword
-            self.last_message = await before.channel.send(
-                content=str(self.last_number),
-                embed=set_embed_author_footer(
+            self.send_count_message(
+                state,
+                str(state.last_number),
+                set_embed_author_footer(
                     discord.Embed(
-                        description=f"{before.author.mention} tried editing their message...\n\n"
-                        f"The count is currently at: {self.get_representation()}",
+                        description=f"{message.author.mention} tried editing their message...\n\n"
+                        f"The count is currently at: {state.get_representation()}",
                         colour=discord.Colour.green(),
                     ),
-                    before.author,
+                    message.author,
                 ),
             )
-            await before.delete()  # Delete original message after self.last_message is set, to prevent triggering deletion detection
+            state.enqueue(
+                message.delete
+            )  # Delete original message after state.last_message is set, to prevent triggering deletion detection
+
+    @commands.Cog.listener("on_raw_message_delete")
+    async def counting_on_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """on_raw_message_delete event handler to allow for handling of counting message deletions (including uncached
+        ones)"""
+        await self.handle_delete(payload.channel_id, {payload.message_id})
+
+    @commands.Cog.listener("on_raw_bulk_message_delete")
+    async def counting_on_bulk_message_delete(
+        self, payload: discord.RawBulkMessageDeleteEvent
+    ):
+        """on_raw_bulk_message_delete event handler to allow for handling of counting message deletions (e.g. purges)"""
+        await self.handle_delete(payload.channel_id, payload.message_ids)
+
+    async def handle_delete(self, channel_id: int, message_ids: set):
+        """Restate the count if the current count was deleted.
 
-    @commands.Cog.listener("on_message_delete")
-    async def counting_on_message_delete(self, message: discord.Message):
-        """on_message_delete event handler to allow for handling of counting message deletions"""
+        :param channel_id: ID of the channel the messages were deleted from
+        :param message_ids: IDs of the deleted messages
+        """
+        for message_id in message_ids:
+            self.deletable.remove(message_id)
+        state = self.get_state(channel_id)
         if (
-            message.channel.id != COUNTING_CHANNEL
-        ):  # Check if we're in counting channel first, to prevent excessive locks
+            state is None
+            or state.last_message is None
+            or state.last_message.id not in message_ids
+        ):  # Checked without the lock first, to prevent excessive locks
             return
 
-        async with self.lock:  # Utilize async lock to prevent parallel message processing edge cases
-            if not self.last_message or message.id != self.last_message.id:
+        async with state.lock:  # Utilize async lock to prevent parallel message processing edge cases
+            if not state.last_message or state.last_message.id not in message_ids:
                 return
+            message = state.last_message
 
             # Do not remove the "deleting" portion of the embed, other segments of code look for that as a keyword
-            self.last_message = await message.channel.send(
-                content=str(self.last_number),
-                embed=set_embed_author_footer(
+            self.send_count_message(
+                state,
+                str(state.last_number),
+                set_embed_author_footer(
                     discord.Embed(
                         description=f"{message.author.mention} tried deleting their message...\n\n"
-                        f"The count is currently at: {self.get_representation()}",
+                        f"The count is currently at: {state.get_representation()}",
                         colour=discord.Colour.dark_green(),
                     ),
                     message.author,
                 ),
             )
 
-    @commands.Cog.listener("on_reaction_add")
-    async def counting_on_reaction_add(
-        self, reaction: discord.Reaction, member: discord.Member
-    ):
-        """on_reaction_add event handler to allow for deletion of select messages (bot must react with 🗑️ for it to be deletable)"""
-        message = reaction.message
+    @commands.Cog.listener("on_raw_reaction_add")
+    async def counting_on_reaction_add(self, payload: discord.RawReactionActionEvent):
+        """on_raw_reaction_add event handler to allow for deletion of select messages (must be in the deletable index,
+        which is filled as we post them with a 🗑️ reaction). Works whether or not the message is cached.
+        """
         if (
-            message.channel.id != COUNTING_CHANNEL
-            or message.author.id != self.bot.user.id
-        ):  # Not counting channel, or message not by us
+            payload.channel_id not in self.states
+            or str(payload.emoji) != "🗑️"
+            or payload.user_id == self.bot.user.id
+        ):  # Not a counting channel, not trash bin emoji, or our own reaction
             return
-        if (
-            reaction.emoji != "🗑️" or member.id == self.bot.user.id
-        ):  # Not trash bin emoji, or our own reaction
+        owners = self.deletable.get(payload.message_id)
+        if owners is None:  # Non-deletable message
             return
-        if not reaction.me:  # We didn't react with 🗑️ (non-deletable message)
+        channel = self.bot.get_channel(payload.channel_id)
+        if channel is None:
             return
-        if (
-            len(message.embeds) == 0
-            or str(member.id) not in message.embeds[0].author.name
-        ):  # Author must be user reacting
-            # Thinking about this, technically if someone changes their nickname to someone else's user ID, that person
-            # could delete because it would match the author.name field, but that's on the person who changed their nick...
-            # - blank, at midnight
-
+        message = channel.get_partial_message(payload.message_id)
+        member = discord.Object(payload.user_id)
+        if payload.user_id not in owners:  # Author must be user reacting
             # Removing reaction at this point because we're far enough in that it's likely an attempt to delete
-            return await reaction.remove(member)
-        await message.delete()
+            return await message.remove_reaction("🗑️", member)
+        remaining = [i for i in owners if i != payload.user_id]
+        if not remaining:
+            self.deletable.remove(payload.message_id)
+            return await message.delete()
+
+        # Only remove their part of coalesced chatter
+        self.deletable.set(payload.message_id, remaining)
+        message = await message.fetch()
+        owners = (
+            self.deletable.get(payload.message_id) or []
+        )  # Others may have removed their part meanwhile
+        await message.edit(
+            embeds=[
+                i
+                for i in message.embeds
+                if i.author.name
+                and any(f"({owner})" in i.author.name for owner in owners)
+            ]
+        )
+        await message.remove_reaction("🗑️", member)
+
+    @commands.command()
+    @commands.has_role(DEVELOPER_ROLE)
+    async def countingoverride(
+        self, ctx: commands.Context, number: int, channel: discord.TextChannel = None
+    ):
+        """Override the current count in counting (defaults to the current channel, or the main counting channel)"""
+        state = self.get_command_state(ctx, channel)
+        if state is None:
+            return await ctx.reply("That channel is not a counting channel.")
+        async with state.lock:
+            state.last_number = number
+            self.send_count_message(
+                state,
+                str(number),
+                set_embed_footer(
+                    discord.Embed(
+                        title="Count Overridden!",
+                        description=f"The current count has been set to: **`{number:,d}`** by {ctx.author.mention}.",
+                        colour=discord.Colour.green(),
+                    )
+                ),
+            )
 
     @commands.command()
     @commands.has_role(DEVELOPER_ROLE)
-    async def countingoverride(self, ctx: commands.Context, number: int):
-        """Override the current count in counting"""
-        self.last_number = number
-        self.last_message = await self.channel.send(
-            content=str(number),
+    async def countingchanneladd(
+        self, ctx: commands.Context, channel: discord.TextChannel
+    ):
+        """Make a channel a counting channel"""
+        if channel.id in self.states:
+            return await ctx.reply(f"{channel.mention} is already a counting channel.")
+        settings = self.config["channels"][str(channel.id)] = {}
+        await asyncio.to_thread(write_json_atomic, CONFIG_FILE, self.config)
+        state = self.states[channel.id] = CountingState(channel.id, settings)
+        await self.init_state(state, {})
+        await ctx.reply(f"{channel.mention} is now a counting channel.")
+
+    @commands.command()
+    @commands.has_role(DEVELOPER_ROLE)
+    async def countingchannelremove(
+        self, ctx: commands.Context, channel: discord.TextChannel
+    ):
+        """Stop a channel from being a counting channel"""
+        if channel.id not in self.states:
+            return await ctx.reply(f"{channel.mention} is not a counting channel.")
+        del self.config["channels"][str(channel.id)]
+        del self.states[channel.id]
+        await asyncio.to_thread(write_json_atomic, CONFIG_FILE, self.config)
+        self.save_checkpoint()
+        await ctx.reply(f"{channel.mention} is no longer a counting channel.")
+
+    @commands.command()
+    @commands.has_role(DEVELOPER_ROLE)
+    async def countingchannels(self, ctx: commands.Context):
+        """List all counting channels, and their current counts"""
+        await ctx.reply(
             embed=set_embed_footer(
                 discord.Embed(
-                    title="Count Overridden!",
-                    description=f"The current count has been set to: **`{number:,d}`** by {ctx.author.mention}.",
-                    colour=discord.Colour.green(),
+                    title="Counting Channels",
+                    description="\n".join(
+                        f"<#{channel_id}>: "
+                        + (
+                            f"**`{state.last_number:,d}`**"
+                            if state.last_number is not None
+                            else "*No count*"
+                        )
+                        for channel_id, state in self.states.items()
+                    )
+                    or "No counting channels.",
+                    colour=discord.Colour.dark_grey(),
                 )
-            ),
+            )
+        )
+
+    @commands.command()
+    @commands.has_role(DEVELOPER_ROLE)
+    async def countingspeedmode(
+        self, ctx: commands.Context, enabled: bool, channel: discord.TextChannel = None
+    ):
+        """Toggle speed mode for a counting channel, where success reactions are only given on milestones, or at most
+        once every few seconds (for counting events)"""
+        state = self.get_command_state(ctx, channel)
+        if state is None:
+            return await ctx.reply("That channel is not a counting channel.")
+        state.settings["speed_mode"] = enabled
+        await asyncio.to_thread(write_json_atomic, CONFIG_FILE, self.config)
+        await ctx.reply(
+            f"Speed mode is now {'enabled' if enabled else 'disabled'} in <#{state.channel_id}>."
+        )
+
+    @commands.command(aliases=["countingstats"])
+    async def countstats(
+        self,
+        ctx: commands.Context,
+        member: discord.Member = None,
+        channel: discord.TextChannel = None,
+    ):
+        """View your (or another member's) counting stats"""
+        state = self.get_command_state(ctx, channel)
+        if state is None:
+            return await ctx.reply("That channel is not a counting channel.")
+        member = member or ctx.author
+        stats = self.stats.get(state.channel_id)
+        rank = stats.counts.rank(member.id)
+        embed = discord.Embed(
+            title="Counting Stats",
+            description=f"Stats for {member.mention} in <#{state.channel_id}>",
+            colour=discord.Colour.dark_grey(),
+        )
+        embed.add_field(
+            name="Counts", value=f"{stats.counts.scores.get(member.id, 0):,d}"
+        )
+        embed.add_field(
+            name="Fails", value=f"{stats.fails.scores.get(member.id, 0):,d}"
         )
+        embed.add_field(name="Rank", value=f"#{rank:,d}" if rank else "N/A")
+        embed.add_field(name="Highest Count (Channel)", value=f"{stats.highest:,d}")
+        embed.add_field(name="Current Streak (Channel)", value=f"{stats.streak:,d}")
+        await ctx.reply(embed=set_embed_author_footer(embed, member))
+
+    @commands.command(aliases=["countlb", "countingleaderboard"])
+    async def countleaderboard(
+        self, ctx: commands.Context, channel: discord.TextChannel = None
+    ):
+        """View the counting leaderboard"""
+        state = self.get_command_state(ctx, channel)
+        if state is None:
+            return await ctx.reply("That channel is not a counting channel.")
+        stats = self.stats.get(state.channel_id)
+        embed = discord.Embed(
+            title="Counting Leaderboard",
+            description=f"<#{state.channel_id}> | Highest count: **{stats.highest:,d}** | "
+            f"Current streak: **{stats.streak:,d}**",
+            colour=discord.Colour.dark_grey(),
+        )
+        embed.add_field(
+            name="Most Counts",
+            value="\n".join(
+                f"{i}. <@{user_id}>: {score:,d}"
+                for i, (user_id, score) in enumerate(stats.counts.top(10), 1)
+            )
+            or "Nobody yet!",
+        )
+        embed.add_field(
+            name="Most Fails",
+            value="\n".join(
+                f"{i}. <@{user_id}>: {score:,d}"
+                for i, (user_id, score) in enumerate(stats.fails.top(10), 1)
+            )
+            or "Nobody yet!",
+        )
+        await ctx.reply(embed=set_embed_footer(embed))
+
+    @staticmethod
+    async def audit_page(audit: CountAudit, page: list, evaluate):
+        """Evaluate a page of messages in parallel, then replay them in order.
+
+        :param audit: Audit to replay the messages in
+        :param page: Messages to replay, in chronological order
+        :param evaluate: Coroutine function to evaluate a message with (bounded get_num)
+        """
+        nums = await asyncio.gather(
+            *(evaluate(i) if audit.is_candidate(i) else asyncio.sleep(0) for i in page)
+        )
+        for message, num in zip(page, nums):
+            audit.replay(message, num)
+
+    @commands.command()
+    @commands.has_role(DEVELOPER_ROLE)
+    @commands.max_concurrency(1)
+    async def countingaudit(
+        self,
+        ctx: commands.Context,
+        channel: discord.TextChannel = None,
+        after: int = None,
+        limit: int = None,
+    ):
+        """Audit the history of a counting channel (optionally after a message ID, and up to a number of messages),
+        replaying it through the counting rules and reporting the count timeline, fails, and anomalies
+        """
+        state = self.get_command_state(ctx, channel)
+        if state is None:
+            return await ctx.reply("That channel is not a counting channel.")
+        status = await ctx.reply(
+            embed=set_embed_footer(
+                discord.Embed(
+                    title="Counting Audit",
+                    description=f"Auditing <#{state.channel_id}>...",
+                    colour=discord.Colour.dark_grey(),
+                )
+            )
+        )
+        semaphore = asyncio.Semaphore(AUDIT_CONCURRENCY)
+
+        async def evaluate(message: discord.Message):
+            async with semaphore:
+                return await get_num(message)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"audit-{state.channel_id}.txt")
+            with open(path, "w", encoding="utf-8", buffering=1024 * 1024) as report:
+                audit = CountAudit(self.bot.user.id, report)
+                last_progress = time.monotonic()
+                page = []
+                async for message in state.channel.history(
+                    limit=limit,
+                    after=discord.Object(after) if after else None,
+                    oldest_first=True,
+                ):
+                    page.append(message)
+                    if len(page) < AUDIT_PAGE_SIZE:
+                        continue
+                    await self.audit_page(audit, page, evaluate)
+                    page = []  # Only ever keep one page in memory
+                    if time.monotonic() - last_progress >= AUDIT_PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        await status.edit(
+                            embed=set_embed_footer(
+                                discord.Embed(
+                                    title="Counting Audit",
+                                    description=f"Auditing <#{state.channel_id}>...\n\n{audit.summary()}",
+                                    colour=discord.Colour.dark_grey(),
+                                )
+                            )
+                        )
+                await self.audit_page(audit, page, evaluate)
+                report.write(f"# {audit.summary().replace('**', '')}\n")
+
+            await status.edit(
+                embed=set_embed_footer(
+                    discord.Embed(
+                        title="Counting Audit Complete",
+                        description=f"Audited <#{state.channel_id}>.\n\n{audit.summary()}",
+                        colour=discord.Colour.green(),
+                    )
+                )
+            )
+            await ctx.reply(file=discord.File(path))
+
+    @commands.command()
+    @commands.has_role(DEVELOPER_ROLE)
+    async def countingcoalesce(
+        self, ctx: commands.Context, enabled: bool, channel: discord.TextChannel = None
+    ):
+        """Toggle chatter coalescing for a counting channel, where non-number messages sent within a few seconds of each
+        other are resent together as one message (reduces API calls when people chat a lot)
+        """
+        state = self.get_command_state(ctx, channel)
+        if state is None:
+            return await ctx.reply("That channel is not a counting channel.")
+        state.settings["coalesce"] = enabled
+        await asyncio.to_thread(write_json_atomic, CONFIG_FILE, self.config)
+        if not enabled:
+            self.flush_chatter(state)
+        await ctx.reply(
+            f"Chatter coalescing is now {'enabled' if enabled else 'disabled'} in <#{state.channel_id}>."
+        )
+
+    @commands.command()
+    @commands.has_role(DEVELOPER_ROLE)
+    async def countingmetrics(self, ctx: commands.Context):
+        """View performance metrics for counting"""
+        embed = discord.Embed(
+            title="Counting Metrics", colour=discord.Colour.dark_grey()
+        )
+        for name, value in {**evaluator.stats(), **evaluation_cache.stats()}.items():
+            if isinstance(value, float):  # Latencies
+                value = f"{value * 1000:.2f}ms"
+            embed.add_field(name=name, value=str(value) if value is not None else "N/A")
+        embed.add_field(
+            name="Reactions Saved (Speed Mode)",
+            value=str(sum(state.reactions_saved for state in self.states.values())),
+        )
+        total = sum(evaluation_paths.values())
+        for name, value in evaluation_paths.items():
+            embed.add_field(
+                name=name,
+                value=f"{value} ({value / total:.1%})" if total else str(value),
+            )
+        await ctx.reply(embed=set_embed_footer(embed))
 
 
 async def setup(bot):
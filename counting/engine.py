@@ -0,0 +1,329 @@
+"""
+Expression evaluation for the counting plugin: the configured simpleeval parser (run in the evaluator pool, see
+counting.EvaluatorPool), and the ExpressionEngine, which evaluates the common numeric subset of its grammar in-process.
+"""
+
+import ast
+import math
+import operator as op
+import warnings
+
+import simpleeval
+
+ENGINE_MAX_LENGTH = 200  # Max length of an expression to be evaluated by the in-process engine (bounds its node count)
+ENGINE_MAX_BITS = 4096  # Max size in bits of any integer the in-process engine may use or produce (~1200 digits)
+
+# Create and configure SimpleEval parser to handle expressions
+s = simpleeval.SimpleEval()
+del s.operators[
+    ast.BitXor
+]  # ^ symbol, which people may confuse for ** (would override, but syntax is slightly diff)
+del s.operators[ast.BitOr]  # | symbol, which people may confuse for abs
+del s.functions[
+    "rand"
+]  # Randomly generates numbers, would cause griefs more often than not
+del s.functions[
+    "randint"
+]  # Randomly generates numbers, would cause griefs more often than not
+s.functions.update(  # Add additional functions
+    floor=math.floor,
+    rounddown=math.floor,
+    round_down=math.floor,
+    ceil=math.ceil,
+    roundup=math.ceil,
+    round_up=math.ceil,
+    round=round,
+    sqrt=math.sqrt,
+    sqroot=math.sqrt,
+    squareroot=math.sqrt,
+    sin=lambda x: math.sin(
+        math.radians(x)
+    ),  # sin takes radians, input as degrees is simpler, so convert deg -> rad
+    cos=lambda x: math.cos(
+        math.radians(x)
+    ),  # cos takes radians, input as degrees is simpler, so convert deg -> rad
+    tan=lambda x: math.tan(
+        math.radians(x)
+    ),  # tan takes radians, input as degrees is simpler, so convert deg -> rad
+    degrees=math.degrees,  # Offer rad -> deg conversion
+    radians=math.radians,  # Offer deg -> rad conversion
+    abs=abs,
+    bitxor=op.xor,  # Reimplement bitwise XOR (^), which was removed to curb symbol confusion
+    bitor=op.or_,  # Reimplement bitwise OR (|), which was removed to curb symbol confusion,
+    log=lambda x, base=10: math.log(x, base),  # Log with default base 10
+    ln=math.log,  # Default math.log (base e)
+)
+s.names.update(  # Add additional variables
+    pi=math.pi,
+    e=math.e,
+)
+simpleeval.MAX_POWER = (
+    10000  # We're never getting that far (prevents timely exponent operations)
+)
+simpleeval.MAX_STRING_LENGTH = (
+    10000  # Shouldn't be using strings much anyway (prevents memory exhaustion)
+)
+
+# Functions that are pure and cheap for bounded inputs, allowed in the in-process engine
+ENGINE_FUNCTIONS = {
+    "int",
+    "float",
+    "floor",
+    "rounddown",
+    "round_down",
+    "ceil",
+    "roundup",
+    "round_up",
+    "round",
+    "sqrt",
+    "sqroot",
+    "squareroot",
+    "sin",
+    "cos",
+    "tan",
+    "degrees",
+    "radians",
+    "abs",
+    "bitxor",
+    "bitor",
+    "log",
+    "ln",
+}
+ENGINE_OPERATORS = {
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.UAdd,
+    ast.USub,
+}
+# Operators whose cost grows faster than linearly with the size of their operands, bounded by ExpressionEngine.bound
+ENGINE_BOUNDED_OPERATORS = {ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow}
+ENGINE_OPERATOR_FUNCTIONS = {
+    op_type: s.operators[op_type] for op_type in ENGINE_OPERATORS
+}  # Same as simpleeval's
+
+
+TOO_MUCH_MATH = (
+    "Too much math!\n*(Something in your expression is taking too long to evaluate)*\n\n"
+    "**If you are seeing this message, please report the expression you used to the bot development team.**"
+)
+
+
+TOO_MUCH_MEMORY = (
+    "Too much math!\n*(Something in your expression is using too much memory to evaluate)*\n\n"
+    "**If you are seeing this message, please report the expression you used to the bot development team.**"
+)
+
+
+def fail_message(e: Exception):
+    """Generate the appropriate user-facing message for an exception raised while evaluating an expression.
+
+    :param e: Exception raised
+    :return: Message to reply to the user with, None if the exception shouldn't be replied to
+    """
+    if isinstance(e, TimeoutError):
+        return TOO_MUCH_MATH
+    elif isinstance(e, MemoryError):  # Evaluator hit its address space limit
+        return TOO_MUCH_MEMORY
+    elif isinstance(e, simpleeval.NumberTooHigh):
+        return (
+            "Why don't you try and calculate that?\n*(A number in your expression is too big -- "
+            "some operations have size limits to prevent time-expensive operations)*"
+        )
+    elif isinstance(e, simpleeval.IterableTooLong):
+        return (
+            "An iterable in your expression is way too big -- there are size limits to prevent "
+            "memory-expensive operations"
+        )
+    elif isinstance(e, simpleeval.FunctionNotDefined):
+        return f"The function `{getattr(e, 'func_name').replace('`', '[backtick]')}` does not exist."
+    elif isinstance(e, simpleeval.OperatorNotDefined):
+        try:
+            op_name = e.attr.__class__.__name__
+            fail_msg = f"The operator `{op_name}` does not exist."
+            if op_name == "BitXor":
+                fail_msg += "\nTo perform a power operation, use `**` instead of `^`."
+            elif op_name == "BitOr":
+                fail_msg += "\nTo get an absolute value, use `abs(content here)` instead of `|content here|`."
+            return fail_msg
+        except (Exception,):
+            return None
+    elif isinstance(e, (SyntaxError, ValueError, TypeError, ZeroDivisionError)):
+        if str(e).startswith(
+            "invalid syntax"
+        ):  # False-positives from messages starting with most symbols (?abc)
+            return None
+        return f"```py\n{repr(e).replace('`', '[backtick]')}\n```"
+    return None
+
+
+def safe_eval(string: str):
+    """Safely run simpleeval's parser. It also generates and returns the appropriate user-facing message for an
+    exception. Should be run through an EvaluatorPool, which provides the backup timeout (via Pebble).
+
+    :param string: String to evaluate (passed into simpleeval)
+    :return: If successful, (result, warnings). If unsuccessful, (Exception, fail_msg)
+    """
+
+    # We generate fail_msg's here, as opposed to relaying the exception, because certain exceptions
+    # (e.g. FunctionNotDefined & OperatorNotDefined) cannot be pickled, and results in another error when we try to
+    # relay it back (really confusing one at that). It's simpler to just handle all message generation logic here.
+    try:
+        with warnings.catch_warnings(record=True) as ws:
+            return s.eval(string), ws
+    except Exception as e:
+        return Exception, fail_message(e)
+
+
+class EngineUnsupported(Exception):
+    """Raised when an expression is outside the engine's grammar or cost bounds, it's then left to simpleeval."""
+
+
+class ExpressionEngine:
+    """Purpose-built evaluator for the numeric subset of simpleeval's grammar, which is all counting needs. Expressions
+    are evaluated the same way simpleeval does (same operator and function tables, same evaluation order and errors),
+    with cost bounds so they can be evaluated in-process without a timeout.
+
+    Expressions are parsed with Python's parser (like simpleeval) and their tree is evaluated directly, anything outside
+    the engine's grammar is left to simpleeval in the pool.
+    """
+
+    def __init__(self, string: str):
+        self.string = string
+
+    @staticmethod
+    def check(value):
+        """Enforce the size bound on a result."""
+        if type(value) is int and value.bit_length() > ENGINE_MAX_BITS:
+            raise EngineUnsupported
+        return value
+
+    @staticmethod
+    def bound(op_type: type, a: int, b: int):
+        """Enforce the cost bounds before running an operation on two integers, which also bound the size of its result:
+        ** can grow integers quickly, and the result of *, /, // and % is at most as large as their operands together
+        (division being quadratic in their size)."""
+        if op_type is ast.Pow:
+            # Operands over MAX_POWER are left to safe_power, which raises NumberTooHigh for them
+            if (
+                0 < b <= simpleeval.MAX_POWER
+                and abs(a) <= simpleeval.MAX_POWER
+                and a.bit_length() * b > ENGINE_MAX_BITS
+            ):
+                raise EngineUnsupported
+        elif a.bit_length() + b.bit_length() > ENGINE_MAX_BITS:
+            raise EngineUnsupported
+
+    @staticmethod
+    def bound_round(args: list, kwargs: dict):
+        """Enforce the cost bounds on round(), which computes a power of 10 to round an integer to negative digits."""
+        ndigits = args[1] if len(args) > 1 else kwargs.get("ndigits")
+        if (
+            args
+            and isinstance(args[0], int)
+            and isinstance(ndigits, int)
+            and -ndigits * 4 > ENGINE_MAX_BITS
+        ):
+            raise EngineUnsupported
+
+    def evaluate_ast(self, node: ast.AST):
+        """Evaluate a node parsed by Python's parser, the same way simpleeval does.
+
+        :param node: Node to evaluate
+        :return: Result
+        :raises EngineUnsupported: Node is outside the engine's grammar or cost bounds
+        """
+        node_type = type(node)
+        if node_type is ast.BinOp:
+            op_type = type(node.op)
+            operator = ENGINE_OPERATOR_FUNCTIONS.get(op_type)
+            if operator is None:
+                self.unsupported_operator(node.op)
+            a, b = self.evaluate_ast(node.left), self.evaluate_ast(node.right)
+            if (
+                op_type in ENGINE_BOUNDED_OPERATORS
+                and type(a) is int
+                and type(b) is int
+            ):
+                self.bound(op_type, a, b)
+            return operator(a, b)
+        elif node_type is ast.Constant:
+            value = node.value
+            if type(value) is int:
+                if value.bit_length() > ENGINE_MAX_BITS:
+                    raise EngineUnsupported
+            elif type(value) is not float:
+                raise EngineUnsupported
+            return value
+        elif node_type is ast.UnaryOp:
+            operator = ENGINE_OPERATOR_FUNCTIONS.get(type(node.op))
+            if operator is None:
+                self.unsupported_operator(node.op)
+            return operator(self.evaluate_ast(node.operand))
+        elif node_type is ast.Name:
+            if node.id in s.names:
+                return s.names[node.id]
+            elif node.id in s.functions:
+                return s.functions[node.id]
+            raise simpleeval.NameNotDefined(node.id, self.string)
+        elif node_type is ast.Call:
+            if type(node.func) is not ast.Name:
+                raise EngineUnsupported
+            if node.func.id not in s.functions:
+                raise simpleeval.FunctionNotDefined(node.func.id, self.string)
+            if node.func.id not in ENGINE_FUNCTIONS or any(
+                k.arg is None for k in node.keywords
+            ):
+                raise EngineUnsupported
+            func = s.functions[node.func.id]
+            # simpleeval passes the arguments as a generator, which is consumed after the keyword arguments are evaluated
+            kwargs = {k.arg: self.evaluate_ast(k.value) for k in node.keywords}
+            args = [self.evaluate_ast(i) for i in node.args]
+            if func is round:
+                self.bound_round(args, kwargs)
+            return self.check(func(*args, **kwargs))
+        raise EngineUnsupported
+
+    def unsupported_operator(self, operator: ast.AST):
+        """Raise the error for an operator outside the engine's grammar: simpleeval's if it doesn't support it either."""
+        if type(operator) not in s.operators:
+            raise simpleeval.OperatorNotDefined(operator, self.string)
+        raise EngineUnsupported
+
+    def evaluate(self):
+        """Evaluate the expression.
+
+        :return: Same as safe_eval, None if the expression is unsupported (and should go to the evaluator pool instead)
+        """
+        if len(self.string) > ENGINE_MAX_LENGTH:
+            return None
+        try:
+            try:
+                with warnings.catch_warnings(
+                    record=True
+                ):  # Parsing can raise SyntaxWarnings, which don't matter
+                    tree = ast.parse(self.string.strip())
+            except (SyntaxError, ValueError) as e:  # simpleeval fails to parse it too
+                return Exception, fail_message(e)
+            # Empty and multiple expressions (with their warning) and statements are left to simpleeval
+            if len(tree.body) != 1 or type(tree.body[0]) is not ast.Expr:
+                return None
+            return self.evaluate_ast(tree.body[0].value), []
+        except (EngineUnsupported, RecursionError, MemoryError):
+            return None
+        except Exception as e:
+            return Exception, fail_message(e)
+
+
+def engine_eval(string: str):
+    """Evaluate an expression in-process with the ExpressionEngine. Results (including error messages) are the same as
+    safe_eval's.
+
+    :param string: String to evaluate
+    :return: Same as safe_eval, None if the expression is unsupported (and should go to the evaluator pool instead)
+    """
+    return ExpressionEngine(string).evaluate()